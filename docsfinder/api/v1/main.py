@@ -1,23 +1,63 @@
+import logging
 from os.path import join
-from typing import List
+from secrets import compare_digest
+from typing import List, Optional
 
-from fastapi import FastAPI, Query, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
 
-from ...core.models import FullDocument
+from ...core.models import (
+    BatchQuery,
+    CacheStats,
+    Document,
+    FullDocument,
+    IndexStatus,
+    SchedulerStats,
+)
+from ...core.storage import IndexFormatError
 from ...dependencies import dependencies
 
 api = FastAPI(title="Docs Finder")
 
 
+def require_admin(authorization: Optional[str] = Header(None)):
+    token = dependencies.admin_token
+    # Index updates are refused unless an admin token is configured
+    if token is None:
+        raise HTTPException(status_code=403, detail="Index updates are disabled")
+    if authorization is None or not compare_digest(
+        authorization.encode(), f"Bearer {token}".encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+ADMIN = [Depends(require_admin)]
+
+
 @api.get("/", include_in_schema=False, tags=["General"])
 def index(request: Request):
     return RedirectResponse(join(request.url.path, "docs"))
 
 
 @api.get("/query", tags=["General"], response_model=List[FullDocument])
-def query(query: str):
-    return dependencies.engine.find(query)
+async def query(query: str):
+    if dependencies.scheduler is None:
+        return await run_in_threadpool(dependencies.engine.find, query)
+    return await dependencies.scheduler.find(query)
+
+
+@api.post(
+    "/query/batch",
+    tags=["General"],
+    response_model=List[List[FullDocument]],
+)
+def query_batch(batch: BatchQuery):
+    return dependencies.engine.find_many(batch.queries, batch.count)
 
 
 @api.get("/query-with-feedback", tags=["General"], response_model=List[FullDocument])
@@ -26,4 +66,71 @@ def query_with_feedback(
     good_feedback: List[int] = Query(...),
     bad_feedback: List[int] = Query(...),
 ):
-    return dependencies.engine.find_with_feedback(query, good_feedback, bad_feedback)
+    try:
+        return dependencies.engine.find_with_feedback(
+            query, good_feedback, bad_feedback
+        )
+    except IndexError as error:
+        raise HTTPException(status_code=422, detail=f"Invalid feedback: {error}")
+
+
+@api.get("/cache", tags=["Admin"], response_model=CacheStats)
+def cache():
+    return dependencies.engine.cache.stats()
+
+
+@api.get("/scheduler", tags=["Admin"], response_model=SchedulerStats)
+def scheduler():
+    if dependencies.scheduler is None:
+        raise HTTPException(status_code=404, detail="Query batching is disabled")
+    return dependencies.scheduler.stats()
+
+
+@api.post("/documents", tags=["Admin"], response_model=List[int], dependencies=ADMIN)
+def add_documents(documents: List[Document]):
+    return dependencies.engine.add_documents(
+        [document.dict() for document in documents]
+    )
+
+
+@api.put(
+    "/documents/{document_id}", tags=["Admin"], response_model=int, dependencies=ADMIN
+)
+def update_document(document_id: str, document: Document):
+    return dependencies.engine.update_document({**document.dict(), "id": document_id})
+
+
+@api.delete("/documents", tags=["Admin"], response_model=int, dependencies=ADMIN)
+def delete_documents(ids: List[str] = Query(...)):
+    return dependencies.engine.delete_documents(ids)
+
+
+@api.post("/documents/merge", tags=["Admin"], dependencies=ADMIN)
+def merge_documents():
+    dependencies.engine.merge()
+
+
+@api.post("/save", tags=["Admin"], response_model=str, dependencies=ADMIN)
+def save():
+    return dependencies.engine.save()
+
+
+@api.get("/index", tags=["Admin"], response_model=IndexStatus)
+def index_status():
+    return dependencies.engine.status()
+
+
+@api.post(
+    "/index/reload", tags=["Admin"], response_model=IndexStatus, dependencies=ADMIN
+)
+def reload_index(version: Optional[str] = None):
+    try:
+        dependencies.engine.load(version)
+    except (OSError, IndexFormatError) as error:
+        raise HTTPException(status_code=404, detail=str(error))
+    except Exception as error:
+        logging.exception(f"Index {version} could not be loaded")
+        raise HTTPException(
+            status_code=422, detail=f"Index could not be loaded: {error!r}"
+        )
+    return dependencies.engine.status()
@@ -0,0 +1,219 @@
+import json
+import platform
+import random
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy as shallow_copy
+from datetime import datetime
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+import numpy as np
+
+from .engine import Engine
+from .evaluation import load_queries, ranking_agreement
+from .ingest import chunks, read_documents
+from .models import Document
+from .vectorizer import Vectorizer
+
+CORPORA = {
+    "cisi": ("data/cisi_data.json", "data/cisi_query.json"),
+    "cran": ("data/cran_data.json", "data/cran_query.json"),
+    "all": ("data/all_data.json", "data/all_query.json"),
+}
+# Metrics where a larger value is an improvement, the rest are costs
+HIGHER_IS_BETTER = {"tokenize_docs_per_second", "batch_queries_per_second"}
+
+Results = Dict[str, Dict[str, float]]
+
+
+def run_benchmarks(
+    corpora: List[str],
+    scales: List[int],
+    n_process: int = 1,
+    batch_size: int = 32,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    results: Results = {}
+    for name in corpora:
+        for scale in scales:
+            key = name if scale == 1 else f"{name}x{scale}"
+            print(f"Benchmarking {key} ...")
+            # Each run gets a fresh process, so its peak RSS is its own
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                results[key] = pool.submit(
+                    benchmark_scaled_corpus, name, scale, n_process, batch_size, seed
+                ).result()
+    return {
+        "created": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processors": n_process,
+        "results": results,
+    }
+
+
+def benchmark_scaled_corpus(
+    name: str,
+    scale: int,
+    n_process: int = 1,
+    batch_size: int = 32,
+    seed: int = 0,
+) -> Dict[str, float]:
+    data, queries = CORPORA[name]
+    documents = list(read_documents(data))
+    return benchmark_corpus(
+        lambda: scale_documents(documents, scale, seed),
+        [query.text for query in load_queries(queries)],
+        n_process,
+        batch_size,
+    )
+
+
+def benchmark_corpus(
+    documents: Callable[[], Iterator[Document]],
+    queries: List[str],
+    n_process: int = 1,
+    batch_size: int = 32,
+) -> Dict[str, float]:
+    result: Dict[str, float] = {}
+    engine = Engine(cache_size=0)
+    start = perf_counter()
+    count = 0
+    texts = (f"{document.title} {document.content}" for document in documents())
+    for _ in engine.tokenizer.analyze_many(texts, {}, n_process=n_process):
+        count += 1
+    result["documents"] = count
+    result["tokenize_docs_per_second"] = count / (perf_counter() - start)
+    start = perf_counter()
+    engine.train((document.dict() for document in documents()), n_process=n_process)
+    result["train_seconds"] = perf_counter() - start
+    with TemporaryDirectory() as root:
+        start = perf_counter()
+        engine.save(root)
+        result["save_seconds"] = perf_counter() - start
+        start = perf_counter()
+        Engine(cache_size=0).load(root=root)
+        result["load_seconds"] = perf_counter() - start
+    latencies = []
+    for query in queries:
+        start = perf_counter()
+        engine.find(query)
+        latencies.append(perf_counter() - start)
+    result.update(percentiles("query", latencies))
+    latencies = []
+    for batch in chunks(queries, batch_size):
+        start = perf_counter()
+        engine.find_many(batch)
+        latencies.append(perf_counter() - start)
+    result.update(percentiles("batch", latencies))
+    result["batch_queries_per_second"] = len(queries) / sum(latencies)
+    # ru_maxrss is the peak of the process, in kilobytes on Linux
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def quantization_report(
+    vectorizer: Vectorizer,
+    texts: List[List[str]],
+    quantizations: Sequence[str],
+    top: int = 10,
+) -> Results:
+    # Rankings and sizes of each mode against the float64 weights
+    reference = shallow_copy(vectorizer)
+    reference.quantize("float64")
+    q_matrix = reference.vectorize_queries(texts)
+    expected = reference.similarity_many(q_matrix, top)
+    weights = weight_bytes(reference)
+    report: Results = {}
+    for quantization in quantizations:
+        quantized = shallow_copy(reference)
+        quantized.quantize(quantization)
+        start = perf_counter()
+        results = quantized.similarity_many(q_matrix, top)
+        elapsed = perf_counter() - start
+        errors = [
+            abs(score - expected_score)
+            for result, expected_result in zip(results, expected)
+            for (_, score), (_, expected_score) in zip(result, expected_result)
+        ]
+        quantized_weights = weight_bytes(quantized)
+        report[quantization] = {
+            "index_mb": sum(segment.nbytes for segment in quantized.segments) / 2 ** 20,
+            "weights_mb": quantized_weights / 2 ** 20,
+            "weights_ratio": weights / max(quantized_weights, 1),
+            "query_seconds": elapsed,
+            "max_score_error": max(errors, default=0.0),
+            **ranking_agreement(
+                [[index for index, _ in result] for result in expected],
+                [[index for index, _ in result] for result in results],
+                top,
+            ),
+        }
+    return report
+
+
+def weight_bytes(vectorizer: Vectorizer) -> int:
+    return sum(
+        segment.tf.data.nbytes
+        + segment.index.data.nbytes
+        + (segment.scales.nbytes if segment.scales is not None else 0)
+        for segment in vectorizer.segments
+    )
+
+
+def scale_documents(
+    documents: List[Document],
+    scale: int,
+    seed: int = 0,
+) -> Iterator[Document]:
+    rng = random.Random(seed)
+    yield from documents
+    for copy in range(1, scale):
+        for document in documents:
+            words = document.content.split()
+            rng.shuffle(words)
+            yield document.copy(
+                update={"id": f"{document.id}_{copy}", "content": " ".join(words)}
+            )
+
+
+def percentiles(name: str, latencies: List[float]) -> Dict[str, float]:
+    values = np.percentile(np.array(latencies) * 1000, [50, 90, 99])
+    return {
+        f"{name}_p50_ms": float(values[0]),
+        f"{name}_p90_ms": float(values[1]),
+        f"{name}_p99_ms": float(values[2]),
+    }
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.1,
+) -> List[str]:
+    regressions = []
+    for corpus, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            previous = baseline["results"].get(corpus, {}).get(metric)
+            if previous is None or metric == "documents":
+                continue
+            if metric in HIGHER_IS_BETTER:
+                regressed = value < previous * (1 - tolerance)
+            else:
+                regressed = value > previous * (1 + tolerance)
+            if regressed:
+                regressions.append(f"{corpus} {metric}: {previous:.4g} -> {value:.4g}")
+    return regressions
+
+
+def save_results(results: Dict[str, Any], filename: str):
+    with open(filename, mode="w") as file:
+        json.dump(results, file, indent=4)
+
+
+def load_results(filename: str) -> Dict[str, Any]:
+    with open(filename) as file:
+        return json.load(file)
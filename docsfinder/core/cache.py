@@ -0,0 +1,142 @@
+import hashlib
+import sqlite3
+import sys
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .models import CacheStats
+
+Result = List[Tuple[int, float]]
+# Distinct stems of a document in order of appearance and their counts
+Analysis = Tuple[List[str], np.ndarray]
+
+
+class QueryCache:
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self.entries: "OrderedDict[Hashable, Tuple[Result, float, int]]" = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Result]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None:
+                if monotonic() - entry[1] > self.ttl:
+                    self.remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, result: Result):
+        if self.max_entries <= 0:
+            return
+        size = entry_size(key, result)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (result, monotonic(), size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key: Hashable):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self.lock:
+            return CacheStats(
+                entries=len(self.entries),
+                bytes=self.bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+
+class AnalysisCache:
+    def __init__(self, path: str, fingerprint: str, batch_size: int = 1000):
+        self.fingerprint = fingerprint
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.pending: List[Tuple[str, str, bytes]] = []
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS analyses "
+            + "(key TEXT PRIMARY KEY, terms TEXT, counts BLOB)"
+        )
+
+    def key(self, text: str) -> str:
+        # The tokenizer settings are part of the key, a change misses every entry
+        return hashlib.sha256(f"{self.fingerprint}\n{text}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Analysis]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT terms, counts FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        terms, counts = row
+        return terms.split("\n") if terms else [], np.frombuffer(counts, np.int32)
+
+    def put(self, key: str, analysis: Analysis):
+        terms, counts = analysis
+        with self.lock:
+            self.pending.append(
+                (key, "\n".join(terms), counts.astype(np.int32).tobytes())
+            )
+            if len(self.pending) < self.batch_size:
+                return
+        self.commit()
+
+    def commit(self):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)", self.pending
+            )
+            self.connection.commit()
+            self.pending = []
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def entry_size(key: Hashable, result: Result) -> int:
+    return (
+        sys.getsizeof(key)
+        + sys.getsizeof(result)
+        + sum(sys.getsizeof(item) for item in result)
+    )
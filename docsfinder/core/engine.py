@@ -1,83 +1,358 @@
 import json
-from typing import List, Optional, cast
+from collections import deque
+from contextvars import ContextVar
+from copy import copy
+from tempfile import TemporaryFile
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Deque, Dict, Iterator, List, Optional, Tuple, cast
 
 import numpy as np
-from pydantic import ValidationError
 
-from .models import Document, FullDocument, IndexedDocument, Model, Query
-from .tokenizer import Tokenizer
-from .vectorizer import Vectorizer
+from .cache import AnalysisCache, QueryCache
+from .evaluation import Evaluation, evaluate, f_measure, load_queries
+from .ingest import Item, Source, chunks, read_documents
+from .metrics import (
+    DOCUMENTS,
+    OPERATIONS,
+    POSTINGS,
+    QUERIES,
+    SEGMENTS,
+    TERMS,
+    stage,
+)
+from .models import Document, FullDocument, IndexStatus
+from .storage import KEEP_VERSIONS, load_index, save_index
+from .store import DocumentStore, DocumentWriter, build_store
+from .tokenizer import Tokenizer, fingerprint
+from .tuning import DEFAULT_SETTING, Setting
+from .vectorizer import TermStatistics, Vectorizer
+
+# Index versions whose snapshots served the current request
+served_versions: ContextVar[Optional[List[Optional[str]]]] = ContextVar(
+    "served_versions", default=None
+)
 
 
 class Engine:
-    def __init__(self):
-        self.documents: List[Document] = []
+    def __init__(
+        self,
+        cache_size: int = 1024,
+        cache_bytes: Optional[int] = None,
+        cache_ttl: Optional[float] = None,
+        max_segments: int = 8,
+        shards: int = 1,
+        latent_rank: Optional[int] = None,
+        rerank: int = 0,
+        pruning: bool = False,
+        quantization: str = "float64",
+        analysis_cache: Optional[str] = None,
+        keep_versions: int = KEEP_VERSIONS,
+        query_repeats: bool = False,
+        query_setting: Optional[Setting] = None,
+    ):
+        self.documents: DocumentStore = build_store([])
         self.tokenizer = Tokenizer()
         self.vectorizer = Vectorizer()
-
-    def save(self):
-        model = Model(
-            documents=self.documents,
-            terms=self.vectorizer.terms,
+        self.cache = QueryCache(cache_size, cache_bytes, cache_ttl)
+        self.version: Optional[str] = None
+        self.ids: Dict[str, int] = {}
+        self.max_segments = max_segments
+        self.shards = shards
+        self.latent_rank = latent_rank
+        self.rerank = rerank
+        self.pruning = pruning
+        self.quantization = quantization
+        self.analyses = (
+            AnalysisCache(analysis_cache, fingerprint()) if analysis_cache else None
         )
-        with open("save/docs_and_terms.json", mode="w+") as file:
-            json.dump(model.dict(), file)
-        np.save("save/idf.npy", self.vectorizer.idf)
-        np.save("save/weights.npy", self.vectorizer.weights)
-
-    def load(self):
-        with open("save/docs_and_terms.json") as file:
-            data = json.load(file)
-            model = Model(**data)
-            self.documents = model.documents
-            self.tokenizer = Tokenizer()
-            self.vectorizer = Vectorizer()
-            self.vectorizer.terms = model.terms
-        self.vectorizer.idf = np.load("save/idf.npy")
-        self.vectorizer.weights = np.load("save/weights.npy")
-
-    def train(self, filename: str):
-        self.documents: List[Document] = []
-        indexed_documents: List[IndexedDocument] = []
+        self.keep_versions = keep_versions
+        # Queries are tokenized and weighed as in the tune command
+        self.query_repeats = query_repeats
+        self.query_setting = {**DEFAULT_SETTING, **(query_setting or {})}
+        self.generation = 0
+        # lock guards the swap of the index, write_lock serialises its updates
+        self.lock = Lock()
+        self.write_lock = Lock()
+
+    def snapshot(self) -> Tuple[int, Vectorizer, DocumentStore]:
+        with self.lock:
+            version = self.version
+            snapshot = self.generation, self.vectorizer, self.documents
+        versions = served_versions.get()
+        if versions is not None:
+            versions.append(version)
+        return snapshot
+
+    def swap(
+        self,
+        vectorizer: Vectorizer,
+        documents: DocumentStore,
+        ids: Optional[Dict[str, int]] = None,
+        version: Optional[str] = None,
+    ):
+        if ids is None:
+            ids = {
+                id: index
+                for index, id in enumerate(documents.ids)
+                if not vectorizer.deleted[index]
+            }
+        with self.lock:
+            self.vectorizer = vectorizer
+            self.documents = documents
+            self.ids = ids
+            self.version = version
+            self.generation += 1
+        self.cache.clear()
+        DOCUMENTS.set(len(ids))
+        TERMS.set(len(vectorizer.terms))
+        SEGMENTS.set(len(vectorizer.segments))
+        POSTINGS.set(sum(segment.tf.nnz for segment in vectorizer.segments))
+
+    def status(self) -> IndexStatus:
+        with self.lock:
+            return IndexStatus(
+                version=self.version,
+                generation=self.generation,
+                documents=len(self.ids),
+                ready=self.ready,
+            )
+
+    def save(self, root: str = "save") -> str:
+        OPERATIONS.inc("save")
+        # Updates wait, so the saved version is exactly the index being served
+        with self.write_lock, stage("save", "write"):
+            _, vectorizer, documents = self.snapshot()
+            self.version = save_index(
+                {**vectorizer.to_arrays(), **documents.to_arrays()},
+                {
+                    "terms.txt": "\n".join(vectorizer.terms).encode(),
+                    **documents.to_files(),
+                    "documents.ids.json": json.dumps(documents.ids).encode(),
+                },
+                {"documents": {"compression": documents.compression}},
+                root,
+                self.keep_versions,
+            )
+        return self.version
+
+    def load(
+        self,
+        version: Optional[str] = None,
+        root: str = "save",
+        background: bool = False,
+    ):
+        OPERATIONS.inc("load")
+        # Queries keep running on the previous index until the swap
+        with self.write_lock:
+            with stage("load", "read"):
+                version, arrays, files, metadata = load_index(root, version)
+            documents = DocumentStore.from_arrays(
+                arrays,
+                files,
+                json.loads(files["documents.ids.json"][:]),
+                metadata["documents"]["compression"],
+            )
+            vectorizer = Vectorizer(pruning=self.pruning)
+            terms = files["terms.txt"][:].decode()
+            vectorizer.from_arrays(terms.split("\n") if terms else [], arrays)
+            self.swap(vectorizer, documents, version=version)
+        # Queries wait on the tokenizer until spaCy is loaded
+        if background:
+            Thread(target=self.warm_up, daemon=True).start()
+        else:
+            self.warm_up()
+
+    def warm_up(self):
+        with stage("load", "tokenizer"):
+            self.tokenizer.load()
+
+    @property
+    def ready(self) -> bool:
+        return self.tokenizer.loaded
+
+    def train(
+        self,
+        source: Source,
+        n_process: int = 1,
+        batch_size: int = 256,
+        chunk_size: int = 1000,
+        compression: Optional[str] = "zlib",
+    ):
+        OPERATIONS.inc("train")
         print("Starting engine ...")
-        print("Loading data ...")
-        with open(filename) as file:
-            data = json.load(file)
-            for item in data:
-                try:
-                    document = Document(**item)
-                    self.documents.append(document)
-                except ValidationError:
-                    continue
-        print("Data loaded")
+        with stage("train", "tokenizer"):
+            self.tokenizer = Tokenizer()
+            # With an analysis cache spaCy waits for a document that misses it
+            if self.analyses is None:
+                self.tokenizer.load()
+        statistics = TermStatistics()
+        writer = DocumentWriter(TemporaryFile(), compression)
+        # Documents wait here while their text is in the tokenizer pipeline
+        pending: Deque[Document] = deque()
+
+        def texts() -> Iterator[str]:
+            for document in read_documents(source):
+                pending.append(document)
+                yield f"{document.title} {document.content}"
+
         print("Indexing documents ...")
-        self.tokenizer = Tokenizer()
-        for item in self.documents:
-            indexed_documents.append(
-                IndexedDocument(
-                    **item.dict(),
-                    indexes=self.tokenizer.tokenize(f"{item.title} {item.content}"),
-                ),
-            )
+        indexes = self.tokenizer.analyze_many(
+            texts(),
+            statistics.term_ids,
+            batch_size=batch_size,
+            n_process=n_process,
+            cache=self.analyses,
+        )
+        start = perf_counter()
+        total = 0
+        with stage("train", "index"):
+            for chunk in chunks(indexes, chunk_size):
+                statistics.update_counts(chunk)
+                for _ in chunk:
+                    writer.write(pending.popleft())
+                total += len(chunk)
+                rate = total / (perf_counter() - start)
+                print(f"Indexed {total} documents ({rate:.1f} documents/s)")
+            documents = writer.close()
+        if self.analyses is not None:
+            hits, misses = self.analyses.hits, self.analyses.misses
+            print(f"Analysis cache: {hits} hits, {misses} misses")
         print("Documents indexed")
-        self.vectorizer = Vectorizer()
-        print("Training model ...")
-        self.vectorizer.train(
-            [document.indexes for document in indexed_documents],
+        vectorizer = Vectorizer(
+            self.shards,
+            latent_rank=self.latent_rank,
+            rerank=self.rerank,
+            pruning=self.pruning,
+            quantization=self.quantization,
         )
+        print("Training model ...")
+        with stage("train", "fit"):
+            vectorizer.fit(statistics)
+        self.swap(vectorizer, documents)
         print("Model trained")
 
+    def add_documents(
+        self,
+        source: Source,
+        n_process: int = 1,
+        batch_size: int = 256,
+    ) -> List[int]:
+        OPERATIONS.inc("add")
+        # A document whose id is already indexed replaces the previous version
+        documents = list({item.id: item for item in read_documents(source)}.values())
+        # Terms get ids in a private vocabulary, mapped once the index is locked
+        vocabulary: Dict[str, int] = {}
+        with stage("add", "tokenize"):
+            indexes = list(
+                self.tokenizer.analyze_many(
+                    (f"{item.title} {item.content}" for item in documents),
+                    vocabulary,
+                    batch_size=batch_size,
+                    n_process=n_process,
+                    cache=self.analyses,
+                )
+            )
+        with self.write_lock, stage("add", "update"):
+            vectorizer = copy(self.vectorizer)
+            replaced = [self.ids[item.id] for item in documents if item.id in self.ids]
+            if replaced:
+                vectorizer.delete(np.array(replaced))
+            statistics = TermStatistics(vectorizer.term_ids)
+            statistics.update_counts(indexes, list(vocabulary))
+            added = vectorizer.add(statistics)
+            ids = dict(self.ids)
+            ids.update(zip((item.id for item in documents), added))
+            self.swap(vectorizer, self.documents.append(documents), ids, self.version)
+        self.schedule_merge()
+        return list(added)
+
+    def update_document(self, item: Item) -> int:
+        document = Document(**item)
+        return self.add_documents([document.dict()])[0]
+
+    def delete_documents(self, ids: List[str]) -> int:
+        OPERATIONS.inc("delete")
+        with self.write_lock, stage("delete", "update"):
+            deleted = [self.ids[id] for id in set(ids) if id in self.ids]
+            if not deleted:
+                return 0
+            vectorizer = copy(self.vectorizer)
+            vectorizer.delete(np.array(deleted))
+            removed = set(ids)
+            remaining = {
+                id: index for id, index in self.ids.items() if id not in removed
+            }
+            self.swap(vectorizer, self.documents, remaining, self.version)
+        return len(deleted)
+
+    def merge(self):
+        OPERATIONS.inc("merge")
+        with self.write_lock, stage("merge", "compact"):
+            vectorizer = copy(self.vectorizer)
+            live = vectorizer.merge()
+            self.swap(vectorizer, self.documents.select(live), version=self.version)
+
+    def schedule_merge(self):
+        vectorizer = self.vectorizer
+        if len(vectorizer.segments) - vectorizer.shards > self.max_segments:
+            Thread(target=self.merge, daemon=True).start()
+
     def find(self, query: str, count: int = 10) -> List[FullDocument]:
-        query_tokens = self.tokenizer.tokenize(query, remove_stopwords=False)
-        results = self.vectorizer.query(list(query_tokens))
-        return [
-            FullDocument(
-                **self.documents[index].dict(),
-                index=index,
-                relevancy=relevancy,
+        OPERATIONS.inc("find")
+        QUERIES.inc("find")
+        generation, vectorizer, documents = self.snapshot()
+        with stage("find", "tokenize"):
+            query_tokens = self.tokenizer.tokenize_query(
+                query, vectorizer.term_ids, self.query_repeats
             )
-            for index, relevancy in results[:count]
+        key = (generation, tuple(sorted(query_tokens)), count)
+        with stage("find", "cache"):
+            results = self.cache.get(key)
+        if results is None:
+            with stage("find", "vectorize"):
+                q_matrix = vectorizer.vectorize_queries(
+                    [list(query_tokens)], self.query_setting["a"]
+                )
+            with stage("find", "similarity"):
+                results = vectorizer.similarity_many(q_matrix, count)[0]
+            self.cache.put(key, results)
+        with stage("find", "hydrate"):
+            return self.full_documents(results, documents)
+
+    def find_many(
+        self,
+        queries: List[str],
+        count: int = 10,
+    ) -> List[List[FullDocument]]:
+        OPERATIONS.inc("find_many")
+        QUERIES.inc("find_many", amount=len(queries))
+        generation, vectorizer, documents = self.snapshot()
+        with stage("find_many", "tokenize"):
+            queries_tokens = self.tokenizer.tokenize_queries(
+                queries, vectorizer.term_ids, self.query_repeats
+            )
+        keys = [
+            (generation, tuple(sorted(query_tokens)), count)
+            for query_tokens in queries_tokens
         ]
+        with stage("find_many", "cache"):
+            results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        with stage("find_many", "vectorize"):
+            q_matrix = vectorizer.vectorize_queries(
+                [list(queries_tokens[i]) for i in missing], self.query_setting["a"]
+            )
+        with stage("find_many", "similarity"):
+            computed = vectorizer.similarity_many(q_matrix, count)
+        for i, result in zip(missing, computed):
+            results[i] = result
+            self.cache.put(keys[i], result)
+        with stage("find_many", "hydrate"):
+            return [
+                self.full_documents(cast(List[Tuple[int, float]], result), documents)
+                for result in results
+            ]
 
     def find_with_feedback(
         self,
@@ -86,85 +361,67 @@ class Engine:
         bad_feedback: List[int],
         count: int = 10,
     ) -> List[FullDocument]:
-        query_tokens = self.tokenizer.tokenize(query, remove_stopwords=False)
-        results = self.vectorizer.query_with_feedback(
-            list(query_tokens),
-            good_feedback,
-            bad_feedback,
+        OPERATIONS.inc("find_with_feedback")
+        QUERIES.inc("find_with_feedback")
+        generation, vectorizer, documents = self.snapshot()
+        with stage("find_with_feedback", "tokenize"):
+            query_tokens = self.tokenizer.tokenize_query(
+                query, vectorizer.term_ids, self.query_repeats
+            )
+        key = (
+            generation,
+            tuple(sorted(query_tokens)),
+            count,
+            tuple(sorted(good_feedback)),
+            tuple(sorted(bad_feedback)),
         )
+        results = self.cache.get(key)
+        if results is None:
+            with stage("find_with_feedback", "rank"):
+                results = vectorizer.query_with_feedback(
+                    list(query_tokens),
+                    good_feedback,
+                    bad_feedback,
+                    count=count,
+                    **self.query_setting,
+                )
+            self.cache.put(key, results)
+        with stage("find_with_feedback", "hydrate"):
+            return self.full_documents(results, documents)
+
+    def full_documents(
+        self,
+        results: List[Tuple[int, float]],
+        documents: DocumentStore,
+    ) -> List[FullDocument]:
         return [
             FullDocument(
-                **self.documents[index].dict(),
+                **documents[index].dict(),
                 index=index,
                 relevancy=relevancy,
             )
-            for index, relevancy in results[:count]
+            for index, relevancy in results
         ]
 
+    def evaluate(self, filename: str, top: int = 10) -> Evaluation:
+        queries = load_queries(filename)
+        _, vectorizer, documents = self.snapshot()
+        queries_tokens = self.tokenizer.tokenize_queries(
+            [query.text for query in queries], vectorizer.term_ids, self.query_repeats
+        )
+        results = vectorizer.query_many(
+            [list(query_tokens) for query_tokens in queries_tokens],
+            self.query_setting["a"],
+            count=top,
+        )
+        rankings = [[documents.ids[index] for index, _ in result] for result in results]
+        return evaluate(queries, rankings, len(self.ids), top)
+
     def test_precision(self, filename: str, top: int = 10) -> float:
-        queries: List[Query] = []
-        with open(filename) as file:
-            data = json.load(file)
-            for item in data:
-                try:
-                    query = Query(**item)
-                    queries.append(query)
-                # except ValidationError as e:
-                # print(e)
-                except ValidationError:
-                    continue
-        global_precisions = []
-        len_queries = len(queries)
-        for index, query in enumerate(queries):
-            print(f"Run query {index + 1} of {len_queries}")
-            result = self.find(query.text, top)
-            mask = [1 if doc.id in query.docs else 0 for doc in result]
-            # print("Result finded")
-            accu = [mask[0]]
-            for i in range(1, len(mask)):
-                accu.append(mask[i] + accu[-1])
-            local_precisions: List[float] = []
-            for i in range(top):
-                if mask[i]:
-                    local_precisions.append(accu[i] / (i + 1))
-            if local_precisions:
-                precision = np.array(local_precisions).mean()
-                global_precisions.append(precision)
-            else:
-                global_precisions.append(0)
-            # print(f"Precision of query {query.id} = {global_precisions[-1]}")
-        precision = np.array(global_precisions).mean()
-        return cast(float, precision)
+        return self.evaluate(filename, top).summary()["precision"]
 
     def test_recall(self, filename: str, top: int = 10) -> float:
-        queries: List[Query] = []
-        with open(filename) as file:
-            data = json.load(file)
-            for item in data:
-                try:
-                    query = Query(**item)
-                    queries.append(query)
-                except ValidationError:
-                    continue
-        global_recalls = []
-        for query in queries:
-            result = self.find(query.text, top)
-            mask = [1 if doc.id in query.docs else 0 for doc in result]
-            accu = [mask[0]]
-            for i in range(1, len(mask)):
-                accu.append(mask[i] + accu[-1])
-            local_recalls: List[float] = []
-            docs_len = len(query.docs)
-            for i in range(top):
-                if mask[i]:
-                    local_recalls.append(accu[i] / docs_len)
-            if local_recalls:
-                recall = np.array(local_recalls).mean()
-                global_recalls.append(recall)
-            else:
-                global_recalls.append(0)
-        recall = np.array(global_recalls).mean()
-        return cast(float, recall)
+        return self.evaluate(filename, top).summary()["recall"]
 
     def test_f(
         self,
@@ -175,46 +432,9 @@ class Engine:
         top: int = 10,
     ) -> float:
         assert filename is not None or (precision is not None and recall is not None)
-        p: float = 0
-        r: float = 0
         if filename:
-            p = self.test_precision(filename, top)
-            r = self.test_recall(filename, top)
-        else:
-            p = cast(float, precision)
-            r = cast(float, recall)
-        f = (1 + beta * beta) * p * r / (beta * beta * p + r)
-        return f
+            return self.evaluate(filename, top).summary(beta)["f"]
+        return f_measure(cast(float, precision), cast(float, recall), beta)
 
     def test_fallout(self, filename: str, top: int = 10) -> float:
-        queries: List[Query] = []
-        with open(filename) as file:
-            data = json.load(file)
-            for item in data:
-                try:
-                    query = Query(**item)
-                    queries.append(query)
-                # except ValidationError as e:
-                # print(e)
-                except ValidationError:
-                    continue
-        global_fallouts = []
-        all_docs_len = len(self.documents)
-        for query in queries:
-            result = self.find(query.text, top)
-            mask = [0 if doc.id in query.docs else 1 for doc in result]
-            accu = [mask[0]]
-            for i in range(1, len(mask)):
-                accu.append(mask[i] + accu[-1])
-            local_fallouts: List[float] = []
-            docs_len = all_docs_len - len(query.docs)
-            for i in range(top):
-                # if mask[i]:
-                local_fallouts.append(accu[i] / docs_len)
-            if local_fallouts:
-                fallout = np.array(local_fallouts).mean()
-                global_fallouts.append(fallout)
-            else:
-                global_fallouts.append(0)
-        fallout = np.array(global_fallouts).mean()
-        return cast(float, fallout)
+        return self.evaluate(filename, top).summary()["fallout"]
@@ -0,0 +1,119 @@
+import json
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+from pydantic import ValidationError
+
+from .models import Query
+
+Metrics = Dict[str, np.ndarray]
+
+
+class Evaluation(NamedTuple):
+    queries: List[Query]
+    rankings: List[List[str]]
+    metrics: Metrics
+
+    def summary(self, beta: float = 1) -> Dict[str, float]:
+        means = {name: float(values.mean()) for name, values in self.metrics.items()}
+        return {
+            "precision": means["precision"],
+            "recall": means["recall"],
+            "f": f_measure(means["precision"], means["recall"], beta),
+            "fallout": means["fallout"],
+            "map": means["average_precision"],
+            "ndcg": means["ndcg"],
+            "mrr": means["reciprocal_rank"],
+        }
+
+    def write_report(self, filename: str):
+        report = [
+            {
+                "id": query.id,
+                "relevant": len(query.docs),
+                "retrieved": ranking,
+                **{name: float(values[i]) for name, values in self.metrics.items()},
+            }
+            for i, (query, ranking) in enumerate(zip(self.queries, self.rankings))
+        ]
+        with open(filename, mode="w") as file:
+            json.dump(report, file, indent=4)
+
+
+def load_queries(filename: str) -> List[Query]:
+    queries: List[Query] = []
+    with open(filename) as file:
+        for item in json.load(file):
+            try:
+                queries.append(Query(**item))
+            except ValidationError:
+                continue
+    return queries
+
+
+def evaluate(
+    queries: List[Query],
+    rankings: List[List[str]],
+    documents: int,
+    top: int = 10,
+) -> Evaluation:
+    relevant = np.zeros((len(queries), top))
+    for i, (query, ranking) in enumerate(zip(queries, rankings)):
+        docs = set(query.docs)
+        relevant[i, : len(ranking[:top])] = [doc in docs for doc in ranking[:top]]
+    counts = np.array([len(query.docs) for query in queries], dtype=np.float64)
+    return Evaluation(queries, rankings, ranking_metrics(relevant, counts, documents))
+
+
+def ranking_metrics(
+    relevant: np.ndarray, counts: np.ndarray, documents: int
+) -> Metrics:
+    ranks = np.arange(1, relevant.shape[1] + 1)
+    hits = relevant.cumsum(axis=1)
+    found = relevant.sum(axis=1)
+    precisions = hits / ranks * relevant
+    recalls = hits / np.maximum(counts, 1)[:, None] * relevant
+    discounts = 1 / np.log2(ranks + 1)
+    ideal = np.concatenate([[0], discounts.cumsum()])
+    ideal = ideal[np.minimum(counts, len(ranks)).astype(np.int64)]
+    first = np.argmax(relevant, axis=1) + 1
+    return {
+        "precision": divide(precisions.sum(axis=1), found),
+        "recall": divide(recalls.sum(axis=1), found),
+        "fallout": ((ranks - hits) / (documents - counts)[:, None]).mean(axis=1),
+        "average_precision": divide(precisions.sum(axis=1), counts),
+        "ndcg": divide((relevant * discounts).sum(axis=1), ideal),
+        "reciprocal_rank": np.where(found > 0, 1 / first, 0.0),
+    }
+
+
+def ranking_agreement(
+    reference: List[List[int]],
+    rankings: List[List[int]],
+    top: int = 10,
+) -> Dict[str, float]:
+    pairs = [
+        (expected[:top], ranking[:top])
+        for expected, ranking in zip(reference, rankings)
+    ]
+    if not pairs:
+        return {"overlap": 1.0, "top1": 1.0, "identical": 1.0}
+    return {
+        "overlap": float(
+            np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in pairs])
+        ),
+        "top1": float(np.mean([a[:1] == b[:1] for a, b in pairs])),
+        "identical": float(np.mean([a == b for a, b in pairs])),
+    }
+
+
+def f_measure(precision: float, recall: float, beta: float = 1) -> float:
+    if not precision and not recall:
+        return 0
+    return (1 + beta * beta) * precision * recall / (beta * beta * precision + recall)
+
+
+def divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    result = np.zeros(len(numerator))
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+    return result
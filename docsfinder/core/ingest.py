@@ -0,0 +1,47 @@
+import json
+from itertools import islice
+from os import listdir
+from os.path import isdir, join
+from typing import Any, Dict, Iterable, Iterator, List, TypeVar, Union
+
+from pydantic import ValidationError
+
+from .models import Document
+
+Item = Dict[str, Any]
+Source = Union[str, Iterable[Item]]
+T = TypeVar("T")
+
+
+def read_items(source: Source) -> Iterator[Item]:
+    if not isinstance(source, str):
+        yield from source
+    elif isdir(source):
+        for name in sorted(listdir(source)):
+            if name.endswith((".json", ".jsonl")):
+                yield from read_items(join(source, name))
+    elif source.endswith(".jsonl"):
+        with open(source) as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(source) as file:
+            yield from json.load(file)
+
+
+def read_documents(source: Source) -> Iterator[Document]:
+    for item in read_items(source):
+        try:
+            yield Document(**item)
+        except ValidationError:
+            continue
+
+
+def chunks(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
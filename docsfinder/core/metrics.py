@@ -0,0 +1,187 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple, TypeVar
+
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+Labels = Tuple[str, ...]
+Timings = List[Tuple[str, float]]
+M = TypeVar("M", bound="Metric")
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def format_labels(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return super().render() + [
+            f"{self.name}{self.format_labels(labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Labels = (),
+        buckets: Tuple[float, ...] = BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels: str):
+        with self.lock:
+            counts = self.counts.setdefault(labels, [0] * (len(self.buckets) + 1))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.sums[labels] = self.sums.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self.lock:
+            series = [(labels, list(counts)) for labels, counts in self.counts.items()]
+            sums = dict(self.sums)
+        for labels, counts in series:
+            total = 0
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                total += count
+                le = self.format_labels(labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {total}")
+            lines.append(f"{self.name}_sum{self.format_labels(labels)} {sums[labels]}")
+            lines.append(f"{self.name}_count{self.format_labels(labels)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render())
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "docsfinder_stage_seconds",
+        "Time spent in each stage of an engine operation.",
+        ("operation", "stage"),
+    )
+)
+OPERATIONS = REGISTRY.register(
+    Counter(
+        "docsfinder_operations_total",
+        "Engine operations performed.",
+        ("operation",),
+    )
+)
+QUERIES = REGISTRY.register(
+    Counter("docsfinder_queries_total", "Queries ranked.", ("operation",))
+)
+DOCUMENTS = REGISTRY.register(
+    Gauge("docsfinder_documents", "Live documents in the index.")
+)
+TERMS = REGISTRY.register(Gauge("docsfinder_terms", "Terms in the vocabulary."))
+SEGMENTS = REGISTRY.register(Gauge("docsfinder_segments", "Segments in the index."))
+POSTINGS = REGISTRY.register(
+    Gauge("docsfinder_postings", "Stored term frequencies, including deleted ones.")
+)
+PRUNING_DOCUMENTS = REGISTRY.register(
+    Counter(
+        "docsfinder_pruning_documents_total",
+        "Matching documents fully scored or skipped by dynamic pruning.",
+        ("outcome",),
+    )
+)
+PRUNING_POSTINGS_SKIPPED = REGISTRY.register(
+    Counter(
+        "docsfinder_pruning_postings_skipped_total",
+        "Postings never read because their terms could not reach the top k.",
+    )
+)
+
+# Stage timings of the current request, reported in its Server-Timing header
+timings: ContextVar[Optional[Timings]] = ContextVar("timings", default=None)
+
+
+@contextmanager
+def stage(operation: str, name: str) -> Iterator[None]:
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, operation, name)
+        current = timings.get()
+        if current is not None:
+            current.append((f"{operation}-{name}", elapsed))
+
+
+def server_timing(entries: Timings) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in entries)
@@ -1,6 +1,9 @@
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, conint, conlist
+
+MAX_BATCH_QUERIES = 256
+MAX_RESULTS = 1000
 
 
 class Document(BaseModel):
@@ -17,18 +20,38 @@ class FullDocument(Document):
     relevancy: float
 
 
-class IndexedDocument(Document):
-    indexes: List[str]
-
-
-class Model(BaseModel):
-    documents: List[Document]
-    terms: List[str]
-
-
 class Query(BaseModel):
     id: str
     source_id: Optional[str]
     source: Optional[str]
     text: str
     docs: List[str]
+
+
+class BatchQuery(BaseModel):
+    queries: conlist(str, max_items=MAX_BATCH_QUERIES)
+    count: conint(ge=1, le=MAX_RESULTS) = 10
+
+
+class CacheStats(BaseModel):
+    entries: int
+    bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class SchedulerStats(BaseModel):
+    pending: int
+    running: int
+    batches: int
+    queries: int
+    window: float
+    max_batch: int
+
+
+class IndexStatus(BaseModel):
+    version: Optional[str]
+    generation: int
+    documents: int
+    ready: bool
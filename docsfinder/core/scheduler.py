@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from .engine import Engine, served_versions
+from .metrics import Timings, timings
+from .models import FullDocument, SchedulerStats
+
+
+class Request(NamedTuple):
+    query: str
+    count: int
+    future: "asyncio.Future[List[FullDocument]]"
+    timings: Optional[Timings]
+    versions: Optional[List[Optional[str]]]
+
+
+class QueryScheduler:
+    def __init__(self, engine: Engine, window: float = 0.002, max_batch: int = 32):
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: List[Request] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: Set["asyncio.Task[None]"] = set()
+        self.running = 0
+        self.batches = 0
+        self.queries = 0
+
+    async def find(self, query: str, count: int = 10) -> List[FullDocument]:
+        loop = asyncio.get_running_loop()
+        request = Request(
+            query, count, loop.create_future(), timings.get(), served_versions.get()
+        )
+        self.pending.append(request)
+        self.queries += 1
+        # An idle scheduler runs the query at once, batches only form under load
+        if len(self.pending) >= self.max_batch or not self.running:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await request.future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.running += len(batch)
+            task = asyncio.ensure_future(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: List[Request]):
+        # The batch's stage timings and index version are shared by every
+        # request in it
+        batch_timings: Timings = []
+        batch_versions: List[Optional[str]] = []
+        timings.set(batch_timings)
+        served_versions.set(batch_versions)
+        self.batches += 1
+        groups: Dict[int, List[Request]] = {}
+        for request in batch:
+            groups.setdefault(request.count, []).append(request)
+        try:
+            for count, requests in groups.items():
+                if len(requests) == 1:
+                    results = [
+                        await run_in_threadpool(
+                            self.engine.find, requests[0].query, count
+                        )
+                    ]
+                else:
+                    results = await run_in_threadpool(
+                        self.engine.find_many,
+                        [request.query for request in requests],
+                        count,
+                    )
+                for request, result in zip(requests, results):
+                    if request.timings is not None:
+                        request.timings.extend(batch_timings)
+                    if request.versions is not None:
+                        request.versions.extend(batch_versions)
+                    # The client may have gone away while the batch was scored
+                    if not request.future.done():
+                        request.future.set_result(result)
+        except Exception as error:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(error)
+        finally:
+            self.running -= len(batch)
+            if self.pending and not self.running:
+                self.flush()
+
+    def stats(self) -> SchedulerStats:
+        return SchedulerStats(
+            pending=len(self.pending),
+            running=self.running,
+            batches=self.batches,
+            queries=self.queries,
+            window=self.window,
+            max_batch=self.max_batch,
+        )
@@ -0,0 +1,147 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+def index_dtype(columns: int) -> np.dtype:
+    # Column ids are posting or term ids, int32 halves them whenever they fit
+    return np.dtype(np.int32 if columns <= np.iinfo(np.int32).max else np.int64)
+
+
+class CSRMatrix:
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        shape: Tuple[int, int],
+    ):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=index_dtype(self.shape[1]))
+        self.data = np.asarray(data)
+
+    @classmethod
+    def from_rows(
+        cls,
+        indices: List[np.ndarray],
+        data: List[np.ndarray],
+        columns: int,
+    ) -> "CSRMatrix":
+        lengths = np.array([len(row) for row in indices], dtype=np.int64)
+        indptr = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        return cls(
+            indptr,
+            np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+            np.concatenate(data) if data else np.zeros(0),
+            (len(indices), columns),
+        )
+
+    @classmethod
+    def vstack(cls, matrices: List["CSRMatrix"], columns: int) -> "CSRMatrix":
+        lengths = [np.diff(matrix.indptr) for matrix in matrices]
+        indptr = np.zeros(sum(matrix.shape[0] for matrix in matrices) + 1, np.int64)
+        if lengths:
+            np.cumsum(np.concatenate(lengths), out=indptr[1:])
+        return cls(
+            indptr,
+            np.concatenate([matrix.indices for matrix in matrices] or [[]]),
+            np.concatenate([matrix.data for matrix in matrices] or [[]]),
+            (len(indptr) - 1, columns),
+        )
+
+    @classmethod
+    def from_vector(cls, vector: np.ndarray) -> "CSRMatrix":
+        indices = np.flatnonzero(vector)
+        return cls.from_rows([indices], [vector[indices]], len(vector))
+
+    @property
+    def nnz(self) -> int:
+        return int(self.indptr[-1])
+
+    def row_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def row(self, index: int) -> np.ndarray:
+        start, end = self.indptr[index], self.indptr[index + 1]
+        result = np.zeros(self.shape[1])
+        result[self.indices[start:end]] = self.data[start:end]
+        return result
+
+    def take_rows(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        starts = self.indptr[ids]
+        lengths = self.indptr[ids + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+        owners = np.repeat(np.arange(len(ids)), lengths)
+        return owners, self.indices[positions], self.data[positions]
+
+    def select_rows(self, ids: np.ndarray) -> "CSRMatrix":
+        _, indices, data = self.take_rows(ids)
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.diff(self.indptr)[ids], out=indptr[1:])
+        return CSRMatrix(indptr, indices, data, (len(ids), self.shape[1]))
+
+    def dot(self, vector: np.ndarray) -> np.ndarray:
+        return np.bincount(
+            self.row_ids(),
+            weights=self.data * vector[self.indices],
+            minlength=self.shape[0],
+        )
+
+    def matmul(self, dense: np.ndarray, block: int = 32) -> np.ndarray:
+        result = np.zeros((self.shape[0], dense.shape[1]))
+        nonempty = np.flatnonzero(np.diff(self.indptr))
+        if not len(nonempty):
+            return result
+        # Columns are done in blocks to bound the nnz x block products
+        for start in range(0, dense.shape[1], block):
+            products = self.data[:, None] * dense[self.indices, start : start + block]
+            result[nonempty, start : start + block] = np.add.reduceat(
+                products, self.indptr[nonempty], axis=0
+            )
+        return result
+
+    def row_norms(self) -> np.ndarray:
+        return np.sqrt(
+            np.bincount(
+                self.row_ids(),
+                weights=np.square(self.data, dtype=np.float64),
+                minlength=self.shape[0],
+            )
+        )
+
+    def transpose(self) -> "CSRMatrix":
+        order = np.argsort(self.indices, kind="stable")
+        counts = np.bincount(self.indices, minlength=self.shape[1])
+        indptr = np.zeros(self.shape[1] + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return CSRMatrix(
+            indptr,
+            self.row_ids()[order],
+            self.data[order],
+            (self.shape[1], self.shape[0]),
+        )
+
+    def to_dense(self) -> np.ndarray:
+        result = np.zeros(self.shape)
+        result[self.row_ids(), self.indices] = self.data
+        return result
+
+    def to_arrays(self, name: str) -> Dict[str, np.ndarray]:
+        return {
+            f"{name}.indptr": self.indptr,
+            f"{name}.indices": self.indices,
+            f"{name}.data": self.data,
+            f"{name}.shape": np.array(self.shape),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], name: str) -> "CSRMatrix":
+        return cls(
+            arrays[f"{name}.indptr"],
+            arrays[f"{name}.indices"],
+            arrays[f"{name}.data"],
+            tuple(arrays[f"{name}.shape"]),
+        )
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from mmap import ACCESS_READ, mmap
+from os.path import basename, exists, getsize, join
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Union
+
+import numpy as np
+
+# Bumped on every change to the stored arrays and files, an index saved in
+# another format has to be rebuilt
+FORMAT_VERSION = 6
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+KEEP_VERSIONS = 5
+
+Arrays = Dict[str, np.ndarray]
+Files = Dict[str, bytes]
+Metadata = Dict[str, Any]
+
+
+class StoredIndex(NamedTuple):
+    version: str
+    arrays: Arrays
+    files: Dict[str, Union[bytes, mmap]]
+    metadata: Metadata
+
+
+class IndexFormatError(ValueError):
+    pass
+
+
+def save_index(
+    arrays: Arrays,
+    files: Files,
+    metadata: Optional[Metadata] = None,
+    root: str = "save",
+    keep: Optional[int] = KEEP_VERSIONS,
+) -> str:
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    directory = join(root, version)
+    os.makedirs(directory)
+    entries = {}
+    for name, array in arrays.items():
+        with open(join(directory, f"{name}.npy"), mode="wb") as file:
+            np.save(file, np.ascontiguousarray(array))
+            sync(file)
+        entries[f"{name}.npy"] = describe(join(directory, f"{name}.npy"))
+    for filename, content in files.items():
+        with open(join(directory, filename), mode="wb") as file:
+            file.write(content)
+            sync(file)
+        entries[filename] = describe(join(directory, filename))
+    # The manifest is written last, a directory without it is an unfinished save
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "files": entries,
+        "metadata": metadata or {},
+    }
+    write_atomic(join(directory, MANIFEST), json.dumps(manifest, indent=4))
+    write_atomic(join(root, CURRENT), version)
+    if keep is not None:
+        remove_old_versions(root, keep)
+    return version
+
+
+def load_index(
+    root: str = "save",
+    version: Optional[str] = None,
+    verify: bool = False,
+) -> StoredIndex:
+    if version is None:
+        version = current_version(root)
+    # Versions are plain entries of root, never paths out of it
+    if version in ("", ".", "..") or basename(version) != version or "\\" in version:
+        raise IndexFormatError(f"Invalid index version {version!r}")
+    directory = join(root, version)
+    if not exists(join(directory, MANIFEST)):
+        raise IndexFormatError(f"Index {version} has no manifest")
+    with open(join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+    if manifest["format"] != FORMAT_VERSION:
+        raise IndexFormatError(f"Unsupported index format {manifest['format']}")
+    arrays: Arrays = {}
+    files: Dict[str, Union[bytes, mmap]] = {}
+    for filename, entry in manifest["files"].items():
+        path = join(directory, filename)
+        if not exists(path) or getsize(path) != entry["size"]:
+            raise IndexFormatError(f"Index file {filename} is missing or truncated")
+        if verify and checksum(path) != entry["sha256"]:
+            raise IndexFormatError(f"Index file {filename} is corrupted")
+        if filename.endswith(".npy"):
+            arrays[filename[: -len(".npy")]] = np.load(path, mmap_mode="r")
+        elif entry["size"]:
+            with open(path, mode="rb") as file:
+                files[filename] = mmap(file.fileno(), 0, access=ACCESS_READ)
+        else:
+            files[filename] = b""
+    return StoredIndex(version, arrays, files, manifest["metadata"])
+
+
+def saved_versions(root: str = "save") -> List[str]:
+    # Saves still being written have no manifest yet and are never listed
+    return sorted(
+        entry for entry in os.listdir(root) if exists(join(root, entry, MANIFEST))
+    )
+
+
+def remove_old_versions(root: str = "save", keep: int = KEEP_VERSIONS) -> List[str]:
+    versions = saved_versions(root)
+    current = current_version(root)
+    removed = [
+        version
+        for version in versions[: max(len(versions) - keep, 0)]
+        if version != current
+    ]
+    for version in removed:
+        # Without its manifest a partly removed version is never loaded
+        os.remove(join(root, version, MANIFEST))
+        shutil.rmtree(join(root, version))
+    return removed
+
+
+def current_version(root: str = "save") -> str:
+    with open(join(root, CURRENT)) as file:
+        return file.read().strip()
+
+
+def describe(path: str) -> Dict[str, object]:
+    return {"size": getsize(path), "sha256": checksum(path)}
+
+
+def checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, mode="rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path: str, content: str):
+    temp = f"{path}.tmp"
+    with open(temp, mode="w") as file:
+        file.write(content)
+        sync(file)
+    os.replace(temp, path)
+
+
+def sync(file: IO):
+    file.flush()
+    os.fsync(file.fileno())
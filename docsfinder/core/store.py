@@ -0,0 +1,175 @@
+import json
+import zlib
+from array import array
+from mmap import ACCESS_READ, mmap
+from tempfile import TemporaryFile
+from typing import IO, Dict, Iterable, List, Optional, Sequence, Union, overload
+
+import numpy as np
+
+from .models import Document
+
+Buffer = Union[bytes, mmap]
+
+
+class RecordSegment:
+    def __init__(self, start: int, records: Buffer, offsets: np.ndarray):
+        self.start = start
+        self.records = records
+        self.offsets = offsets
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.offsets) - 1
+
+
+class DocumentStore(Sequence[Document]):
+    def __init__(
+        self,
+        segments: List[RecordSegment],
+        ids: List[str],
+        compression: Optional[str] = None,
+    ):
+        # Every add writes a segment, only select compacts them into one
+        self.segments = segments
+        self.starts = np.array([segment.start for segment in segments], np.int64)
+        self.ids = ids
+        self.compression = compression
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @overload
+    def __getitem__(self, index: int) -> Document:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Document]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("document index out of range")
+        return decode_document(self.record(index), self.compression)
+
+    def record(self, index: int, owner: Optional[int] = None) -> bytes:
+        if owner is None:
+            owner = int(np.searchsorted(self.starts, index, "right")) - 1
+        segment = self.segments[owner]
+        start = segment.offsets[index - segment.start]
+        end = segment.offsets[index - segment.start + 1]
+        return segment.records[start:end]
+
+    def append(self, documents: Iterable[Document]) -> "DocumentStore":
+        writer = DocumentWriter(TemporaryFile(), self.compression, len(self))
+        for document in documents:
+            writer.write(document)
+        if not writer.ids:
+            return self
+        added = writer.close()
+        segments = [segment for segment in self.segments if segment.end > segment.start]
+        return DocumentStore(
+            segments + added.segments, self.ids + added.ids, self.compression
+        )
+
+    def select(self, indices: np.ndarray) -> "DocumentStore":
+        writer = DocumentWriter(TemporaryFile(), self.compression)
+        writer.copy(self, indices)
+        return writer.close()
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            f"documents.{i}.offsets": segment.offsets
+            for i, segment in enumerate(self.segments)
+        }
+
+    def to_files(self) -> Dict[str, Buffer]:
+        return {
+            f"documents.{i}.bin": segment.records
+            for i, segment in enumerate(self.segments)
+        }
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: Dict[str, np.ndarray],
+        files: Dict[str, Buffer],
+        ids: List[str],
+        compression: Optional[str] = None,
+    ) -> "DocumentStore":
+        segments: List[RecordSegment] = []
+        start = 0
+        while f"documents.{len(segments)}.offsets" in arrays:
+            name = f"documents.{len(segments)}"
+            segment = RecordSegment(
+                start, files[f"{name}.bin"], arrays[f"{name}.offsets"]
+            )
+            segments.append(segment)
+            start = segment.end
+        return cls(segments, ids, compression)
+
+
+class DocumentWriter:
+    def __init__(
+        self,
+        file: IO[bytes],
+        compression: Optional[str] = "zlib",
+        start: int = 0,
+    ):
+        self.file = file
+        self.compression = compression
+        self.start = start
+        self.offsets = array("q", [0])
+        self.ids: List[str] = []
+
+    def write(self, document: Document):
+        record = encode_document(document, self.compression)
+        self.file.write(record)
+        self.offsets.append(self.offsets[-1] + len(record))
+        self.ids.append(document.id)
+
+    def copy(self, store: DocumentStore, indices: np.ndarray):
+        # Records are copied as they are, without decoding them
+        owners = np.searchsorted(store.starts, indices, "right") - 1
+        for index, owner in zip(indices.tolist(), owners.tolist()):
+            record = store.record(index, owner)
+            self.file.write(record)
+            self.offsets.append(self.offsets[-1] + len(record))
+            self.ids.append(store.ids[index])
+
+    def close(self) -> DocumentStore:
+        self.file.flush()
+        records: Buffer = b""
+        if self.offsets[-1]:
+            records = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        self.file.close()
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        return DocumentStore(
+            [RecordSegment(self.start, records, offsets)],
+            self.ids,
+            self.compression,
+        )
+
+
+def build_store(
+    documents: Iterable[Document],
+    compression: Optional[str] = "zlib",
+) -> DocumentStore:
+    writer = DocumentWriter(TemporaryFile(), compression)
+    for document in documents:
+        writer.write(document)
+    return writer.close()
+
+
+def encode_document(document: Document, compression: Optional[str]) -> bytes:
+    record = json.dumps(document.dict()).encode()
+    return zlib.compress(record) if compression == "zlib" else record
+
+
+def decode_document(record: bytes, compression: Optional[str]) -> Document:
+    data = zlib.decompress(record) if compression == "zlib" else record
+    return Document(**json.loads(data))
@@ -1,28 +1,272 @@
+import hashlib
+import json
 import re
-from typing import Dict, Iterable, Match, Pattern
+from collections import Counter, deque
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
+from itertools import chain
+from threading import Lock
+from typing import (
+    Container,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Match,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+    cast,
+)
 
+import numpy as np
 from nltk.stem.snowball import SnowballStemmer
+from spacy import __version__ as spacy_version
 from spacy import load
+from spacy.lang.en.stop_words import STOP_WORDS
+from spacy.language import Language
+
+from .cache import Analysis, AnalysisCache
+from .vectorizer import TermCounts, count_terms, map_counts
+
+MODEL = "en_core_web_sm"
+# Components whose output is never read by token_is_valid
+UNUSED_COMPONENTS = ["parser", "ner", "lemmatizer"]
+REJECTED_POS = ["ADP", "AUX", "CONJ", "DET", "PART", "PRON", "SCONJ"]
+# Bumped whenever a change to the analysis code alters its output
+ANALYSIS_VERSION = 1
 
 
 class Tokenizer:
-    def __init__(self):
-        self.nlp = load("en_core_web_sm")
+    def __init__(self, stem_cache_size: int = 65536):
         self.stemmer = SnowballStemmer(language="english")
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stem_word)
+        # spaCy is only loaded on first use, or by an explicit load()
+        self.model: Optional[Language] = None
+        self.words: Set[str] = set()
+        self.special_words: Set[str] = set()
+        self.lock = Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    @property
+    def nlp(self) -> Language:
+        return self.load()
+
+    @property
+    def ambiguous_words(self) -> Set[str]:
+        self.load()
+        return self.words
+
+    @property
+    def tokenizer_exceptions(self) -> Set[str]:
+        self.load()
+        return self.special_words
+
+    def load(self) -> Language:
+        with self.lock:
+            if self.model is None:
+                nlp = load(MODEL, exclude=UNUSED_COMPONENTS)
+                self.words = (
+                    set(nlp.Defaults.stop_words) - FUNCTION_WORDS | AMBIGUOUS_WORDS
+                )
+                self.special_words = set(nlp.tokenizer.rules)
+                self.model = nlp
+            return self.model
+
+    def tokenize(
+        self, text: str, remove_stopwords: bool = True, repeats: bool = False
+    ) -> Iterable[str]:
+        doc = self.nlp(preprocess(text))
+        return self.stem_tokens(doc, remove_stopwords, repeats)
+
+    def tokenize_many(
+        self,
+        texts: Iterable[str],
+        remove_stopwords: bool = True,
+        batch_size: int = 256,
+        n_process: int = 1,
+        repeats: bool = False,
+    ) -> Iterator[Iterable[str]]:
+        docs = self.nlp.pipe(
+            (preprocess(text) for text in texts),
+            batch_size=batch_size,
+            n_process=n_process,
+        )
+        return (self.stem_tokens(doc, remove_stopwords, repeats) for doc in docs)
+
+    def analyze_many(
+        self,
+        texts: Iterable[str],
+        term_ids: Dict[str, int],
+        batch_size: int = 256,
+        n_process: int = 1,
+        cache: Optional[AnalysisCache] = None,
+    ) -> Iterator[TermCounts]:
+        # New terms are added to term_ids as the documents are tokenized
+        if cache is not None:
+            return (
+                map_counts(terms, counts, term_ids)
+                for terms, counts in self.analyze_cached(
+                    texts, cache, batch_size, n_process
+                )
+            )
+        docs = self.nlp.pipe(
+            (preprocess(text) for text in texts),
+            batch_size=batch_size,
+            n_process=n_process,
+        )
+        return (count_terms(self.stems(doc, True), term_ids) for doc in docs)
+
+    def analyze_cached(
+        self,
+        texts: Iterable[str],
+        cache: AnalysisCache,
+        batch_size: int = 256,
+        n_process: int = 1,
+    ) -> Iterator[Analysis]:
+        # Texts read ahead by spaCy wait here, hits included, to keep the order
+        entries: Deque[Tuple[str, Optional[Analysis]]] = deque()
+
+        def misses() -> Iterator[str]:
+            for text in texts:
+                key = cache.key(text)
+                entries.append((key, cache.get(key)))
+                if entries[-1][1] is None:
+                    yield preprocess(text)
+
+        source = misses()
+        docs: Optional[Iterator] = None
+        parsed: Deque = deque()
+        exhausted = False
+        while True:
+            while entries and entries[0][1] is not None:
+                yield cast(Analysis, entries.popleft()[1])
+            if entries:
+                if not parsed:
+                    parsed.append(next(cast(Iterator, docs)))
+                key, _ = entries.popleft()
+                analysis = self.analyze(parsed.popleft())
+                cache.put(key, analysis)
+                yield analysis
+            elif exhausted:
+                break
+            elif docs is None:
+                # spaCy is only loaded once a text misses the cache
+                try:
+                    text = next(source)
+                except StopIteration:
+                    exhausted = True
+                    continue
+                docs = iter(
+                    self.nlp.pipe(
+                        chain([text], source),
+                        batch_size=batch_size,
+                        n_process=n_process,
+                    )
+                )
+            else:
+                try:
+                    parsed.append(next(docs))
+                except StopIteration:
+                    exhausted = True
+        cache.commit()
+
+    def analyze(self, doc) -> Analysis:
+        counts = Counter(self.stems(doc, True))
+        return list(counts), np.fromiter(counts.values(), np.int32, len(counts))
 
-    def tokenize(self, text: str, remove_stopwords: bool = True) -> Iterable[str]:
-        lower_text = text.lower()
-        expanded_text = expand_contractions(lower_text)
-        cleaned_text = clean_text(expanded_text)
-        preprocessed_text = remove_extra_spaces(cleaned_text)
-        doc = self.nlp(preprocessed_text)
-        result = set()
+    def stem_tokens(
+        self, doc, remove_stopwords: bool, repeats: bool = False
+    ) -> Iterable[str]:
+        # Repeated stems only weigh the query terms in the tuner
+        stems = self.stems(doc, remove_stopwords)
+        return list(stems) if repeats else set(stems)
+
+    def stems(self, doc, remove_stopwords: bool) -> Iterator[str]:
         for token in doc:
             if token_is_valid(token, remove_stopwords):
-                temp = self.stemmer.stem(token.text).lower()
-                result.add(temp)
+                yield self.stem(token.text)
+
+    def tokenize_query(
+        self,
+        text: str,
+        vocabulary: Optional[Container[str]] = None,
+        repeats: bool = False,
+    ) -> Iterable[str]:
+        return self.tokenize_queries([text], vocabulary, repeats)[0]
+
+    def tokenize_queries(
+        self,
+        texts: List[str],
+        vocabulary: Optional[Container[str]] = None,
+        repeats: bool = False,
+    ) -> List[Iterable[str]]:
+        results: List[Optional[Iterable[str]]] = []
+        for text in texts:
+            result = self.lookup_query(preprocess(text).split(), vocabulary)
+            results.append(result if repeats or result is None else set(result))
+        fallback = [i for i, result in enumerate(results) if result is None]
+        tokens = self.tokenize_many(
+            (texts[i] for i in fallback),
+            remove_stopwords=False,
+            repeats=repeats,
+        )
+        for i, result in zip(fallback, tokens):
+            results[i] = result
+        return cast(List[Iterable[str]], results)
+
+    def lookup_query(
+        self,
+        words: List[str],
+        vocabulary: Optional[Container[str]] = None,
+    ) -> Optional[List[str]]:
+        result = []
+        for word in words:
+            if word in FUNCTION_WORDS:
+                continue
+            if word in self.tokenizer_exceptions:
+                return None
+            if len(word) <= 2 or word in self.ambiguous_words:
+                # Only the tagger can tell whether these are kept, but a stem
+                # outside the vocabulary never weighs the query either way
+                if vocabulary is not None and self.stem(word) not in vocabulary:
+                    continue
+                return None
+            result.append(self.stem(word))
         return result
 
+    def stem_word(self, word: str) -> str:
+        return self.stemmer.stem(word).lower()
+
+
+def fingerprint() -> str:
+    try:
+        model = version(MODEL)
+    except PackageNotFoundError:
+        model = None
+    settings = {
+        "analysis": ANALYSIS_VERSION,
+        "spacy": spacy_version,
+        "model": model,
+        "exclude": UNUSED_COMPONENTS,
+        "stop_words": sorted(STOP_WORDS),
+        "rejected_pos": REJECTED_POS,
+        "stemmer": "english",
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def preprocess(text: str) -> str:
+    lower_text = text.lower()
+    expanded_text = expand_contractions(lower_text)
+    cleaned_text = clean_text(expanded_text)
+    return remove_extra_spaces(cleaned_text)
+
 
 def remove_extra_spaces(text: str) -> str:
     return re.sub(" +", " ", text)
@@ -46,11 +290,38 @@ def token_is_valid(token, remove_stopwords: bool) -> bool:
     if token.is_space:
         # print(f"Token '{token}' is a space.")
         return False
-    if token.pos_ in ["ADP", "AUX", "CONJ", "DET", "PART", "PRON", "SCONJ"]:
+    if token.pos_ in REJECTED_POS:
         return False
     return True
 
 
+# fmt: off
+# Words always tagged as one of the POS rejected by token_is_valid
+FUNCTION_WORDS: Set[str] = {
+    "the", "an", "this", "these", "those", "which", "whose", "whom", "who",
+    "what", "whatever", "whichever", "whoever", "it", "its", "itself", "he",
+    "him", "his", "himself", "she", "hers", "herself", "we", "us", "our", "ours",
+    "ourselves", "they", "them", "their", "theirs", "themselves", "you", "your",
+    "yours", "yourself", "yourselves", "me", "my", "myself", "is", "are", "was",
+    "were", "be", "been", "being", "would", "should", "could", "must", "shall",
+    "of", "at", "with", "from", "into", "onto", "upon", "within", "among",
+    "amongst", "between", "during", "toward", "towards", "via", "against",
+    "despite", "amid", "without", "to", "not", "because", "although", "whether",
+    "if", "unless", "whereas",
+}
+
+# Words outside the spaCy stop words that the tagger may still reject
+AMBIGUOUS_WORDS: Set[str] = {
+    "like", "unlike", "near", "nearer", "nearest", "versus", "concerning",
+    "following", "considering", "including", "according", "given", "plus",
+    "minus", "past", "till", "notwithstanding", "worth", "need", "needs",
+    "dare", "ought", "inside", "outside", "underneath", "opposite", "round",
+    "whilst", "lest", "beneath", "alongside", "amidst", "barring", "excluding",
+    "pending", "save", "unto", "wanna", "gonna",
+}
+# fmt: on
+
+
 def expand_contractions(text: str) -> str:
     def repl(match: Match[str]) -> str:
         return contractions_dict[match.group(0)]
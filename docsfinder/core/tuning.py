@@ -0,0 +1,164 @@
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import product
+from multiprocessing import get_all_start_methods, get_context
+from typing import Dict, Iterable, List, Optional, Tuple, cast
+
+import numpy as np
+
+from .evaluation import evaluate
+from .models import Query
+from .sparse import CSRMatrix
+from .vectorizer import Vectorizer
+
+PARAMETERS = ("a", "rocchio_a", "b", "y")
+
+Setting = Dict[str, float]
+
+# The query weighting and Rocchio coefficients of the vectorizer
+DEFAULT_SETTING: Setting = {"a": 0.4, "rocchio_a": 1.0, "b": 0.75, "y": 0.15}
+Ranking = List[Tuple[int, float]]
+
+# The tuner of the forked worker processes
+tuner: Optional["Tuner"] = None
+
+
+class Tuner:
+    def __init__(
+        self,
+        vectorizer: Vectorizer,
+        queries: List[Query],
+        queries_tokens: List[Iterable[str]],
+        ids: List[str],
+        top: int = 10,
+        feedback: int = 0,
+    ):
+        self.vectorizer = vectorizer
+        self.queries = queries
+        self.ids = ids
+        self.top = top
+        self.feedback = feedback
+        self.documents = int(np.count_nonzero(~vectorizer.deleted))
+        # Query terms and judgements are only prepared once for every setting
+        self.counts = vectorizer.count_queries(
+            [list(tokens) for tokens in queries_tokens]
+        )
+        positions = {id: index for index, id in enumerate(ids)}
+        self.relevant = [
+            {positions[doc] for doc in query.docs if doc in positions}
+            for query in queries
+        ]
+
+    def evaluate(self, settings: List[Setting]) -> List[Dict[str, float]]:
+        first: Dict[float, Tuple[CSRMatrix, List[Ranking]]] = {}
+        summaries = []
+        for setting in settings:
+            if setting["a"] not in first:
+                q_matrix = self.vectorizer.weigh_queries(self.counts, setting["a"])
+                count = max(self.top, self.feedback)
+                first[setting["a"]] = (
+                    q_matrix,
+                    self.vectorizer.similarity_many(q_matrix, count),
+                )
+            q_matrix, results = first[setting["a"]]
+            if self.feedback:
+                results = self.rerank(q_matrix, results, setting)
+            rankings = [
+                [self.ids[index] for index, _ in result[: self.top]]
+                for result in results
+            ]
+            evaluation = evaluate(self.queries, rankings, self.documents, self.top)
+            summaries.append(evaluation.summary())
+        return summaries
+
+    def rerank(
+        self,
+        q_matrix: CSRMatrix,
+        results: List[Ranking],
+        setting: Setting,
+    ) -> List[Ranking]:
+        # The judged top results act as the user's Rocchio feedback
+        rows = []
+        for i, result in enumerate(results):
+            judged = [index for index, _ in result[: self.feedback]]
+            rows.append(
+                self.vectorizer.feedback_rocchio(
+                    q_matrix.select_rows(np.array([i])),
+                    [index for index in judged if index in self.relevant[i]],
+                    [index for index in judged if index not in self.relevant[i]],
+                    setting["rocchio_a"],
+                    setting["b"],
+                    setting["y"],
+                )
+            )
+        return self.vectorizer.similarity_many(
+            CSRMatrix.vstack(rows, q_matrix.shape[1]), self.top
+        )
+
+    def run(
+        self,
+        settings: List[Setting],
+        processes: int = 1,
+    ) -> List[Dict[str, float]]:
+        # Workers are forked so they share the index instead of pickling it
+        if processes <= 1 or "fork" not in get_all_start_methods():
+            return self.evaluate(settings)
+        order = sorted(range(len(settings)), key=lambda i: settings[i]["a"])
+        chunks = [list(chunk) for chunk in np.array_split(order, processes * 4)]
+        with ProcessPoolExecutor(
+            processes,
+            mp_context=get_context("fork"),
+            initializer=set_tuner,
+            initargs=(self,),
+        ) as pool:
+            results = pool.map(
+                evaluate_settings, [[settings[i] for i in chunk] for chunk in chunks]
+            )
+            summaries: List[Dict[str, float]] = [{} for _ in settings]
+            for chunk, chunk_summaries in zip(chunks, results):
+                for i, summary in zip(chunk, chunk_summaries):
+                    summaries[i] = summary
+        return summaries
+
+
+def set_tuner(value: Tuner):
+    global tuner
+    # Threads of the parent's executor are not forked with it
+    value.vectorizer.executor = ThreadPoolExecutor()
+    tuner = value
+
+
+def evaluate_settings(settings: List[Setting]) -> List[Dict[str, float]]:
+    return cast(Tuner, tuner).evaluate(settings)
+
+
+def grid(values: Dict[str, List[float]]) -> List[Setting]:
+    return [
+        dict(zip(PARAMETERS, setting))
+        for setting in product(*(values[name] for name in PARAMETERS))
+    ]
+
+
+def sample(values: Dict[str, List[float]], count: int, seed: int = 0) -> List[Setting]:
+    # Each parameter is drawn uniformly between its smallest and largest value
+    rng = random.Random(seed)
+    return [
+        {name: rng.uniform(min(values[name]), max(values[name])) for name in PARAMETERS}
+        for _ in range(count)
+    ]
+
+
+def load_setting(filename: str) -> Tuple[bool, Setting]:
+    with open(filename) as file:
+        results = json.load(file)
+    return results.get("repeats", False), results["best"]
+
+
+def best(
+    settings: List[Setting],
+    summaries: List[Dict[str, float]],
+    metric: str = "map",
+) -> int:
+    sign = -1 if metric == "fallout" else 1
+    return max(range(len(settings)), key=lambda i: sign * summaries[i][metric])
@@ -1,37 +1,437 @@
-from math import log10
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Tuple, cast
 
 import numpy as np
 
+from .metrics import PRUNING_DOCUMENTS, PRUNING_POSTINGS_SKIPPED
+from .sparse import CSRMatrix
+
+QUANTIZATIONS = ("float64", "float32", "float16", "int8")
+# Largest dense score buffer and postings read when scoring a block of queries
+BLOCK_CELLS = 1 << 20
+BLOCK_POSTINGS = 1 << 16
+# Blocks with fewer postings than 1 / SPARSE_RATIO of their dense score cells
+# are summed over their matched documents only
+SPARSE_RATIO = 16
+
+# Sorted term ids of a document and their number of occurrences
+TermCounts = Tuple[np.ndarray, np.ndarray]
+
+
+class TermStatistics:
+    def __init__(self, term_ids: Optional[Dict[str, int]] = None):
+        self.term_ids: Dict[str, int] = dict(term_ids or {})
+        self.lengths: List[np.ndarray] = []
+        self.indices: List[np.ndarray] = []
+        self.counts: List[np.ndarray] = []
+
+    def update(self, docs: Iterable[Iterable[str]]):
+        self.update_counts(count_terms(doc, self.term_ids) for doc in docs)
+
+    def update_counts(
+        self,
+        docs: Iterable[TermCounts],
+        vocabulary: Optional[List[str]] = None,
+    ):
+        # Ids from another vocabulary are mapped to this one's
+        docs = list(docs)
+        indices = concatenate([ids for ids, _ in docs], np.int32)
+        if vocabulary is not None:
+            mapping = np.fromiter(
+                (
+                    self.term_ids.setdefault(term, len(self.term_ids))
+                    for term in vocabulary
+                ),
+                dtype=np.int32,
+                count=len(vocabulary),
+            )
+            indices = mapping[indices]
+        self.lengths.append(np.array([len(ids) for ids, _ in docs], dtype=np.int64))
+        self.indices.append(indices.astype(np.int32, copy=False))
+        self.counts.append(concatenate([counts for _, counts in docs], np.int32))
+
+    def matrix(self) -> CSRMatrix:
+        lengths = concatenate(self.lengths, np.int64)
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        counts = concatenate(self.counts, np.int32)
+        maxima = np.ones(len(lengths))
+        nonempty = np.flatnonzero(lengths)
+        if len(nonempty):
+            maxima[nonempty] = np.maximum.reduceat(counts, indptr[nonempty])
+        return CSRMatrix(
+            indptr,
+            concatenate(self.indices, np.int32),
+            counts / np.repeat(maxima, lengths),
+            (len(lengths), len(self.term_ids)),
+        )
+
+
+class Segment:
+    def __init__(
+        self,
+        start: int,
+        tf: CSRMatrix,
+        index: Optional[CSRMatrix] = None,
+        scales: Optional[np.ndarray] = None,
+    ):
+        self.start = start
+        self.tf = tf
+        self.index = tf.transpose() if index is None else index
+        # Per-term step of the int8 frequencies, None when they are floats
+        self.scales = scales
+
+    @classmethod
+    def quantized(cls, start: int, tf: CSRMatrix, quantization: str) -> "Segment":
+        if quantization != "int8":
+            data = tf.data.astype(quantization)
+            return cls(start, CSRMatrix(tf.indptr, tf.indices, data, tf.shape))
+        index = tf.transpose()
+        maxima = np.zeros(index.shape[0])
+        nonempty = np.flatnonzero(np.diff(index.indptr))
+        if len(nonempty):
+            maxima[nonempty] = np.maximum.reduceat(index.data, index.indptr[nonempty])
+        scales = maxima / 127
+        return cls(
+            start,
+            CSRMatrix(
+                tf.indptr, tf.indices, encode(tf.data, scales[tf.indices]), tf.shape
+            ),
+            CSRMatrix(
+                index.indptr,
+                index.indices,
+                encode(index.data, scales[index.row_ids()]),
+                index.shape,
+            ),
+            scales,
+        )
+
+    @property
+    def end(self) -> int:
+        return self.start + self.tf.shape[0]
+
+    @property
+    def frequencies(self) -> CSRMatrix:
+        return CSRMatrix(
+            self.tf.indptr,
+            self.tf.indices,
+            self.dequantize(self.tf.indices, self.tf.data),
+            self.tf.shape,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.tf.indptr, self.tf.indices, self.tf.data]
+        arrays += [self.index.indptr, self.index.indices, self.index.data]
+        if self.scales is not None:
+            arrays.append(self.scales)
+        return sum(array.nbytes for array in arrays)
+
+    def dequantize(self, terms: np.ndarray, data: np.ndarray) -> np.ndarray:
+        values = np.asarray(data, dtype=np.float64)
+        if self.scales is not None:
+            values = values * self.scales[terms]
+        return values
+
+
+class LatentSemanticIndex:
+    def __init__(self, embeddings: np.ndarray, projection: np.ndarray):
+        # Unit document rows and the terms to latent space projection
+        self.embeddings = embeddings
+        self.projection = projection
+
+    @classmethod
+    def fit(
+        cls,
+        weights: CSRMatrix,
+        rank: int,
+        oversample: int = 10,
+        iterations: int = 2,
+        seed: int = 0,
+    ) -> "LatentSemanticIndex":
+        rank = min(rank, *weights.shape)
+        transposed = weights.transpose()
+        rng = np.random.default_rng(seed)
+        omega = rng.standard_normal((weights.shape[1], rank + oversample))
+        q, _ = np.linalg.qr(weights.matmul(omega))
+        for _ in range(iterations):
+            q, _ = np.linalg.qr(transposed.matmul(q))
+            q, _ = np.linalg.qr(weights.matmul(q))
+        _, _, vt = np.linalg.svd(transposed.matmul(q).T, full_matrices=False)
+        projection = vt[:rank]
+        return cls(cls.embed(weights, projection), projection)
+
+    @staticmethod
+    def embed(weights: CSRMatrix, projection: np.ndarray) -> np.ndarray:
+        embeddings = weights.matmul(projection.T)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+        return embeddings.astype(np.float32)
+
+    def fold_in(self, weights: CSRMatrix) -> "LatentSemanticIndex":
+        # Terms that are new to the vocabulary have no latent direction
+        projection = np.zeros((len(self.projection), weights.shape[1]))
+        projection[:, : self.projection.shape[1]] = self.projection
+        embeddings = self.embed(weights, projection)
+        return LatentSemanticIndex(
+            np.concatenate([self.embeddings, embeddings]), projection
+        )
+
+    def scores(self, q_matrix: CSRMatrix) -> np.ndarray:
+        q_latent = self.embed(q_matrix, self.projection)
+        return q_latent @ self.embeddings.T
+
 
 class Vectorizer:
-    def __init__(self):
-        self.idf: np.ndarray
-        self.terms: List[str]
-        self.weights: np.ndarray
-
-    def train(self, docs: List[List[str]]):
-        terms = [item for item in {term for doc in docs for term in doc}]
-        len_docs = len(docs)
-        len_terms = len(terms)
-        freq_vect = np.zeros((len_docs, len_terms))
-        for i in range(freq_vect.shape[0]):
-            for j in range(freq_vect.shape[1]):
-                freq_vect[i, j] = docs[i].count(terms[j])
-        max_vect = np.amax(freq_vect, 1)
-        f_vect = (freq_vect.T / max_vect).T
-        idf = np.vectorize(lambda x: log10(len_docs / x))(
-            np.count_nonzero(freq_vect, 0)
-        )
-        for i in range(f_vect.shape[0]):
-            f_vect[i, :] *= idf
+    def __init__(
+        self,
+        shards: int = 1,
+        workers: Optional[int] = None,
+        latent_rank: Optional[int] = None,
+        rerank: int = 0,
+        pruning: bool = False,
+        quantization: str = "float64",
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization}")
+        self.shards = shards
+        self.pruning = pruning
+        self.quantization = quantization
+        self.latent_rank = latent_rank
+        self.rerank = rerank
+        self.lsi: Optional[LatentSemanticIndex] = None
+        self.executor = ThreadPoolExecutor(workers)
+        self.terms: List[str] = []
+        self.term_ids: Dict[str, int] = {}
+        self.segments: List[Segment] = []
+        self.df = np.zeros(0, dtype=np.int64)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.idf = np.zeros(0)
+        self.norms = np.zeros(0)
+        self.bounds = np.zeros(0)
+
+    def train(self, docs: Iterable[Iterable[str]]):
+        statistics = TermStatistics()
+        statistics.update(docs)
+        self.fit(statistics)
+
+    def fit(self, statistics: TermStatistics):
+        tf = statistics.matrix()
+        self.terms = list(statistics.term_ids)
+        self.term_ids = statistics.term_ids
+        self.segments = self.partition(tf)
+        self.deleted = np.zeros(tf.shape[0], dtype=bool)
+        self.df = np.bincount(tf.indices, minlength=len(self.terms))
+        self.update_weights()
+        self.fit_latent()
+
+    # Segments and statistics are rebound and never modified in place, so a
+    # shallow copy can be updated while queries keep reading the original
+    def add(self, statistics: TermStatistics) -> range:
+        tf = statistics.matrix()
+        start = len(self.deleted)
+        self.terms = self.terms + list(statistics.term_ids)[len(self.terms) :]
+        self.term_ids = statistics.term_ids
+        segment = Segment.quantized(start, tf, self.quantization)
+        self.segments = self.segments + [segment]
+        self.deleted = np.concatenate([self.deleted, np.zeros(tf.shape[0], bool)])
+        df = np.bincount(tf.indices, minlength=len(self.terms))
+        df[: len(self.df)] += self.df
+        self.df = df
+        self.update_weights()
+        if self.lsi is not None:
+            self.lsi = self.lsi.fold_in(self.weighted(segment.frequencies))
+        return range(start, start + tf.shape[0])
+
+    def delete(self, ids: np.ndarray):
+        ids = np.unique(ids)
+        ids = ids[~self.deleted[ids]]
+        removed = [
+            segment.tf.take_rows(
+                ids[(ids >= segment.start) & (ids < segment.end)] - segment.start
+            )[1]
+            for segment in self.segments
+        ]
+        self.df = self.df - np.bincount(
+            concatenate(removed, np.int64),
+            minlength=len(self.df),
+        )
+        deleted = self.deleted.copy()
+        deleted[ids] = True
+        self.deleted = deleted
+        self.update_weights()
+
+    def merge(self) -> np.ndarray:
+        live = np.flatnonzero(~self.deleted)
+        rows = [
+            segment.frequencies.select_rows(
+                live[(live >= segment.start) & (live < segment.end)] - segment.start
+            )
+            for segment in self.segments
+        ]
+        self.segments = self.partition(CSRMatrix.vstack(rows, len(self.terms)))
+        self.deleted = np.zeros(len(live), dtype=bool)
+        self.update_weights()
+        self.fit_latent()
+        return live
+
+    def partition(self, tf: CSRMatrix) -> List[Segment]:
+        bounds = np.linspace(0, tf.shape[0], self.shards + 1).astype(np.int64)
+        return [
+            Segment.quantized(
+                int(start), tf.select_rows(np.arange(start, end)), self.quantization
+            )
+            for start, end in zip(bounds[:-1], bounds[1:])
+            if end > start
+        ]
+
+    def quantize(self, quantization: str):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization}")
+        self.quantization = quantization
+        self.segments = [
+            Segment.quantized(segment.start, segment.frequencies, quantization)
+            for segment in self.segments
+        ]
+        self.update_weights()
+
+    def fit_latent(self):
+        if self.latent_rank:
+            self.lsi = LatentSemanticIndex.fit(self.weights, self.latent_rank)
+        else:
+            self.lsi = None
+
+    def update_weights(self):
+        live = np.count_nonzero(~self.deleted)
+        idf = np.zeros(len(self.df))
+        present = self.df > 0
+        idf[present] = np.log10(live / self.df[present])
         self.idf = idf
+        self.norms = concatenate(
+            [
+                np.sqrt(
+                    np.bincount(
+                        segment.tf.row_ids(),
+                        weights=np.square(
+                            segment.dequantize(segment.tf.indices, segment.tf.data)
+                            * idf[segment.tf.indices]
+                        ),
+                        minlength=segment.tf.shape[0],
+                    )
+                )
+                for segment in self.segments
+            ],
+            np.float64,
+        )
+        self.bounds = self.term_bounds()
+
+    def term_bounds(self) -> np.ndarray:
+        # The largest weight of each term in a unit document, before IDF
+        bounds = np.zeros(len(self.df))
+        for segment in self.segments:
+            index = segment.index
+            if not index.nnz:
+                continue
+            norms = self.norms[index.indices + segment.start]
+            values = np.zeros(index.nnz)
+            tf = segment.dequantize(index.row_ids(), index.data)
+            np.divide(tf, norms, out=values, where=norms > 0)
+            nonempty = np.flatnonzero(np.diff(index.indptr))
+            maxima = np.maximum.reduceat(values, index.indptr[nonempty])
+            bounds[nonempty] = np.maximum(bounds[nonempty], maxima)
+        return bounds
+
+    @property
+    def weights(self) -> CSRMatrix:
+        return self.weighted(
+            CSRMatrix.vstack(
+                [segment.frequencies for segment in self.segments], len(self.terms)
+            )
+        )
+
+    def weighted(self, tf: CSRMatrix) -> CSRMatrix:
+        return CSRMatrix(
+            tf.indptr,
+            tf.indices,
+            tf.data * self.idf[tf.indices],
+            (tf.shape[0], len(self.terms)),
+        )
+
+    def row(self, index: int) -> np.ndarray:
+        _, terms, weights = self.rows(np.array([index]))
+        result = np.zeros(len(self.terms))
+        result[terms] = weights
+        return result
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {
+            "idf": self.idf,
+            "norms": self.norms,
+            "df": self.df,
+            "deleted": self.deleted,
+            "bounds": self.bounds,
+            "shards": np.array([self.shards]),
+        }
+        if self.lsi is not None:
+            arrays["lsi.embeddings"] = self.lsi.embeddings
+            arrays["lsi.projection"] = self.lsi.projection
+            arrays["lsi.rerank"] = np.array([self.rerank])
+        for i, segment in enumerate(self.segments):
+            arrays.update(segment.tf.to_arrays(f"segments.{i}.tf"))
+            arrays.update(segment.index.to_arrays(f"segments.{i}.index"))
+            if segment.scales is not None:
+                arrays[f"segments.{i}.scales"] = segment.scales
+        return arrays
+
+    def from_arrays(self, terms: List[str], arrays: Dict[str, np.ndarray]):
         self.terms = terms
-        self.weights = f_vect
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.idf = arrays["idf"]
+        self.norms = arrays["norms"]
+        self.df = arrays["df"]
+        self.deleted = arrays["deleted"]
+        self.shards = int(arrays["shards"][0]) if "shards" in arrays else 1
+        self.lsi = None
+        self.latent_rank = None
+        if "lsi.embeddings" in arrays:
+            self.lsi = LatentSemanticIndex(
+                arrays["lsi.embeddings"], arrays["lsi.projection"]
+            )
+            self.latent_rank = len(self.lsi.projection)
+            self.rerank = int(arrays["lsi.rerank"][0])
+        self.segments = []
+        start = 0
+        while f"segments.{len(self.segments)}.tf.indptr" in arrays:
+            name = f"segments.{len(self.segments)}"
+            segment = Segment(
+                start,
+                CSRMatrix.from_arrays(arrays, f"{name}.tf"),
+                CSRMatrix.from_arrays(arrays, f"{name}.index"),
+                arrays.get(f"{name}.scales"),
+            )
+            self.segments.append(segment)
+            start = segment.end
+        if self.segments:
+            self.quantization = str(self.segments[0].tf.data.dtype)
+        self.bounds = arrays["bounds"] if "bounds" in arrays else self.term_bounds()
+
+    def query(
+        self,
+        text: List[str],
+        a: float = 0.4,
+        count: int = 10,
+    ) -> List[Tuple[int, float]]:
+        return self.query_many([text], a, count)[0]
 
-    def query(self, text: List[str], a: float = 0.4) -> List[Tuple[int, float]]:
-        q_vect = self.vectorize_query(text, a)
-        return self.similarity(q_vect)
+    def query_many(
+        self,
+        texts: List[List[str]],
+        a: float = 0.4,
+        count: int = 10,
+    ) -> List[List[Tuple[int, float]]]:
+        q_matrix = self.vectorize_queries(texts, a)
+        return self.similarity_many(q_matrix, count)
 
     def query_with_feedback(
         self,
@@ -39,57 +439,532 @@ class Vectorizer:
         good_feedback: List[int],
         bad_feedback: List[int],
         a: float = 0.4,
+        count: int = 10,
+        rocchio_a: float = 1.0,
+        b: float = 0.75,
+        y: float = 0.15,
     ) -> List[Tuple[int, float]]:
-        q_vect = self.vectorize_query(text, a)
-        fb_vect = self.feedback_rocchio(q_vect, good_feedback, bad_feedback)
-        return self.similarity(fb_vect)
+        q_matrix = self.vectorize_queries([text], a)
+        fb_matrix = self.feedback_rocchio(
+            q_matrix, good_feedback, bad_feedback, rocchio_a, b, y
+        )
+        return self.similarity_many(fb_matrix, count)[0]
 
     def feedback_rocchio(
         self,
-        q_vect: np.ndarray,
+        q_matrix: CSRMatrix,
         good_feedback: List[int],
         bad_feedback: List[int],
         a: float = 1.0,
         b: float = 0.75,
         y: float = 0.15,
-    ) -> np.ndarray:
-        good_len = len(good_feedback)
-        bad_len = len(bad_feedback)
-        sum1 = np.zeros_like(q_vect)
-        for index in good_feedback:
-            sum1 += self.weights[index]
-        sum2 = np.zeros_like(q_vect)
-        for index in bad_feedback:
-            sum2 += self.weights[index]
-        term1 = q_vect * a
-        term2 = (b / good_len) * sum1 if good_len else 0
-        term3 = (y / bad_len) * sum2 if bad_len else 0
-        return term1 + term2 - term3
+    ) -> CSRMatrix:
+        good_ids = np.array(good_feedback, dtype=np.int64)
+        bad_ids = np.array(bad_feedback, dtype=np.int64)
+        _, good_terms, good_weights = self.rows(good_ids)
+        _, bad_terms, bad_weights = self.rows(bad_ids)
+        terms = np.concatenate([q_matrix.indices, good_terms, bad_terms])
+        weights = np.concatenate(
+            [
+                q_matrix.data * a,
+                good_weights * (b / max(len(good_ids), 1)),
+                bad_weights * (-y / max(len(bad_ids), 1)),
+            ]
+        )
+        terms, inverse = np.unique(terms, return_inverse=True)
+        weights = np.bincount(inverse, weights=weights, minlength=len(terms))
+        nonzero = weights != 0
+        return CSRMatrix.from_rows(
+            [terms[nonzero]], [weights[nonzero]], len(self.terms)
+        )
+
+    def rows(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Negative ids count from the end, as with the document store
+        if np.any((ids < -len(self.deleted)) | (ids >= len(self.deleted))):
+            raise IndexError("document index out of range")
+        ids = np.where(ids < 0, ids + len(self.deleted), ids)
+        owners: List[np.ndarray] = []
+        terms: List[np.ndarray] = []
+        weights: List[np.ndarray] = []
+        for segment in self.segments:
+            inside = np.flatnonzero((ids >= segment.start) & (ids < segment.end))
+            segment_owners, segment_terms, segment_tf = segment.tf.take_rows(
+                ids[inside] - segment.start
+            )
+            owners.append(inside[segment_owners])
+            terms.append(segment_terms)
+            weights.append(
+                segment.dequantize(segment_terms, segment_tf) * self.idf[segment_terms]
+            )
+        return (
+            concatenate(owners, np.int64),
+            concatenate(terms, np.int64),
+            concatenate(weights, np.float64),
+        )
 
     def vectorize_query(self, text: List[str], a: float = 0.4) -> np.ndarray:
-        freq_vect = np.zeros_like(self.idf)
-        for i in range(freq_vect.size):
-            freq_vect[i] = text.count(self.terms[i])
-        maxn = freq_vect.max()
-        q_vect = np.zeros_like(freq_vect)
-        for i in range(q_vect.size):
-            if freq_vect[i]:
-                q_vect[i] = self.idf[i] * (a + (1 - a) * freq_vect[i] / maxn)
-            else:
-                q_vect[i] = 0
-        return q_vect
-
-    def similarity(self, q_vect: np.ndarray) -> List[Tuple[int, float]]:
-        ranks = [
-            (i, self.cosine_similarity(row, q_vect))
-            for i, row in enumerate(self.weights)
+        return self.vectorize_queries([text], a).row(0)
+
+    def vectorize_queries(self, texts: List[List[str]], a: float = 0.4) -> CSRMatrix:
+        return self.weigh_queries(self.count_queries(texts), a)
+
+    def count_queries(self, texts: List[List[str]]) -> CSRMatrix:
+        indices: List[np.ndarray] = []
+        data: List[np.ndarray] = []
+        for text in texts:
+            ids = np.fromiter(
+                (self.term_ids[term] for term in text if term in self.term_ids),
+                dtype=np.int64,
+            )
+            ids, freqs = np.unique(ids, return_counts=True)
+            indices.append(ids)
+            data.append(freqs.astype(np.float64))
+        return CSRMatrix.from_rows(indices, data, len(self.terms))
+
+    def weigh_queries(self, counts: CSRMatrix, a: float = 0.4) -> CSRMatrix:
+        lengths = np.diff(counts.indptr)
+        maxima = np.ones(counts.shape[0])
+        nonempty = np.flatnonzero(lengths)
+        if len(nonempty):
+            maxima[nonempty] = np.maximum.reduceat(counts.data, counts.indptr[nonempty])
+        return CSRMatrix(
+            counts.indptr,
+            counts.indices,
+            self.idf[counts.indices]
+            * (a + (1 - a) * counts.data / np.repeat(maxima, lengths)),
+            counts.shape,
+        )
+
+    def similarity(
+        self,
+        q_vect: np.ndarray,
+        count: int = 10,
+    ) -> List[Tuple[int, float]]:
+        return self.similarity_many(CSRMatrix.from_vector(q_vect), count)[0]
+
+    def similarity_many(
+        self,
+        q_matrix: CSRMatrix,
+        count: int = 10,
+    ) -> List[List[Tuple[int, float]]]:
+        if self.lsi is not None:
+            return self.similarity_latent(q_matrix, count)
+        if self.pruning:
+            return self.similarity_pruned(q_matrix, count)
+        return self.similarity_exhaustive(q_matrix, count)
+
+    def similarity_exhaustive(
+        self,
+        q_matrix: CSRMatrix,
+        count: int = 10,
+    ) -> List[List[Tuple[int, float]]]:
+        # Segments are scored in parallel and their top results merged
+        score = partial(self.score_segment, q_matrix, q_matrix.row_norms(), count)
+        if len(self.segments) > 1:
+            results = list(self.executor.map(score, self.segments))
+        else:
+            results = [score(segment) for segment in self.segments]
+        rows = concatenate([result[0] for result in results], np.int64)
+        order = np.argsort(rows, kind="stable")
+        rows = rows[order]
+        candidates = concatenate([result[1] for result in results], np.int64)[order]
+        scores = concatenate([result[2] for result in results], np.float64)[order]
+        bounds = np.searchsorted(rows, np.arange(q_matrix.shape[0] + 1))
+        return [
+            self.rank(candidates[start:end], scores[start:end], count)
+            for start, end in zip(bounds[:-1], bounds[1:])
         ]
-        ranks.sort(key=lambda x: x[1], reverse=True)
-        return ranks
 
-    def cosine_similarity(self, doc: np.ndarray, qry: np.ndarray):
+    def similarity_latent(
+        self,
+        q_matrix: CSRMatrix,
+        count: int = 10,
+    ) -> List[List[Tuple[int, float]]]:
+        lsi = cast(LatentSemanticIndex, self.lsi)
+        live = np.flatnonzero(~self.deleted)
+        scores = lsi.scores(q_matrix)[:, live].astype(np.float64)
+        results = []
+        for i in range(q_matrix.shape[0]):
+            if not self.rerank:
+                results.append(self.rank(*top_k(live, scores[i], count), count))
+                continue
+            # The best latent candidates are rescored with the exact weights
+            candidates, _ = top_k(live, scores[i], max(self.rerank, count))
+            start, end = q_matrix.indptr[i], q_matrix.indptr[i + 1]
+            exact = self.exact_scores(
+                q_matrix.indices[start:end], q_matrix.data[start:end], candidates
+            )
+            results.append(self.rank(*top_k(candidates, exact, count), count))
+        return results
+
+    def exact_scores(
+        self,
+        terms: np.ndarray,
+        weights: np.ndarray,
+        ids: np.ndarray,
+    ) -> np.ndarray:
+        order = np.argsort(terms)
+        terms, weights = terms[order], weights[order]
+        owners, doc_terms, doc_weights = self.rows(ids)
+        positions = np.minimum(np.searchsorted(terms, doc_terms), len(terms) - 1)
+        matched = np.flatnonzero(terms[positions] == doc_terms) if len(terms) else []
+        dots = np.bincount(
+            owners[matched],
+            weights=doc_weights[matched] * weights[positions[matched]],
+            minlength=len(ids),
+        )
+        norms = self.norms[ids] * np.linalg.norm(weights)
+        scores = np.zeros(len(ids))
+        np.divide(dots, norms, out=scores, where=norms > 0)
+        return scores
+
+    def similarity_pruned(
+        self,
+        q_matrix: CSRMatrix,
+        count: int = 10,
+    ) -> List[List[Tuple[int, float]]]:
+        if count <= 0:
+            return [[] for _ in range(q_matrix.shape[0])]
+        q_norms = q_matrix.row_norms()
+        results = []
+        for i in range(q_matrix.shape[0]):
+            start, end = q_matrix.indptr[i], q_matrix.indptr[i + 1]
+            terms, weights = q_matrix.indices[start:end], q_matrix.data[start:end]
+            if np.any(weights < 0) or not q_norms[i]:
+                # Upper bounds only hold for positive queries
+                row = CSRMatrix.from_rows([terms], [weights], q_matrix.shape[1])
+                results.append(self.similarity_exhaustive(row, count)[0])
+                continue
+            ids, scores = self.maxscore(terms, weights, q_norms[i], count)
+            results.append(self.rank(ids, scores, count))
+        return results
+
+    def maxscore(
+        self,
+        terms: np.ndarray,
+        weights: np.ndarray,
+        q_norm: float,
+        count: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        ids = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0)
+        order = np.argsort(terms)
+        terms, weights = terms[order], weights[order]
+        evaluated = skipped = postings_skipped = 0
+        for segment in self.segments:
+            inside = terms < segment.index.shape[0]
+            if not inside.any():
+                continue
+            lists = PostingLists(segment, terms[inside], weights[inside], self.idf)
+            bounds = lists.weights * lists.idf * self.bounds[lists.terms] / q_norm
+            # A first threshold comes from the best documents of the strongest term
+            strongest = int(np.argmax(bounds))
+            docs, partial = self.partial_segment_scores(
+                segment, lists, np.array([strongest]), q_norm
+            )
+            docs = docs[top_k(np.arange(len(docs)), partial, count)[0]]
+            ids, scores = merge_top(
+                ids,
+                scores,
+                docs + segment.start,
+                self.exact_segment_scores(segment, lists, q_norm, docs),
+                count,
+            )
+            evaluated += len(docs)
+            # Documents only found in the weakest lists can't reach the threshold
+            slack = threshold(scores, count)
+            ascending = np.argsort(bounds, kind="stable")
+            cumulative = np.cumsum(bounds[ascending])
+            weak = int(np.searchsorted(cumulative, slack))
+            essential = np.sort(ascending[weak:])
+            postings_skipped += int(lists.lengths[ascending[:weak]].sum())
+            remainder = float(cumulative[weak - 1]) if weak else 0.0
+            docs, partial = self.partial_segment_scores(
+                segment, lists, essential, q_norm
+            )
+            total = len(docs)
+            # The weak terms are added strongest first, dropping documents
+            # as soon as their bound falls under the threshold
+            for i in ascending[:weak][::-1]:
+                keep = partial + remainder >= slack
+                docs, partial = docs[keep], partial[keep]
+                partial += self.term_segment_scores(segment, lists, i, q_norm, docs)
+                remainder -= float(bounds[i])
+            candidates = docs[partial + max(remainder, 0.0) >= slack]
+            skipped += total - len(candidates)
+            candidates = candidates[~np.isin(candidates + segment.start, ids)]
+            evaluated += len(candidates)
+            ids, scores = merge_top(
+                ids,
+                scores,
+                candidates + segment.start,
+                self.exact_segment_scores(segment, lists, q_norm, candidates),
+                count,
+            )
+        PRUNING_DOCUMENTS.inc("evaluated", amount=evaluated)
+        PRUNING_DOCUMENTS.inc("skipped", amount=skipped)
+        PRUNING_POSTINGS_SKIPPED.inc(amount=postings_skipped)
+        return ids, scores
+
+    def partial_segment_scores(
+        self,
+        segment: Segment,
+        lists: "PostingLists",
+        selected: np.ndarray,
+        q_norm: float,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        owners, docs, tf = segment.index.take_rows(lists.terms[selected])
+        live = ~self.deleted[docs + segment.start]
+        owners, docs, tf = owners[live], docs[live], tf[live]
+        tf = segment.dequantize(lists.terms[selected][owners], tf)
+        docs, inverse = np.unique(docs, return_inverse=True)
+        dots = np.bincount(
+            inverse,
+            weights=tf * lists.idf[selected][owners] * lists.weights[selected][owners],
+            minlength=len(docs),
+        )
+        norms = self.norms[docs + segment.start] * q_norm
+        partial = np.zeros(len(docs))
+        np.divide(dots, norms, out=partial, where=norms > 0)
+        return docs, partial
+
+    def term_segment_scores(
+        self,
+        segment: Segment,
+        lists: "PostingLists",
+        i: int,
+        q_norm: float,
+        docs: np.ndarray,
+    ) -> np.ndarray:
+        dots = np.zeros(len(docs))
+        term_docs = lists.docs(i)
+        if len(term_docs):
+            positions = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+            hit = term_docs[positions] == docs
+            dots[hit] = lists.tf(i)[positions[hit]] * lists.idf[i] * lists.weights[i]
+        norms = self.norms[docs + segment.start] * q_norm
+        scores = np.zeros(len(docs))
+        np.divide(dots, norms, out=scores, where=norms > 0)
+        return scores
+
+    def exact_segment_scores(
+        self,
+        segment: Segment,
+        lists: "PostingLists",
+        q_norm: float,
+        docs: np.ndarray,
+    ) -> np.ndarray:
+        # Same operations in the same term order as exhaustive scoring, so
+        # the scores, and therefore the ties, are identical
+        dots = np.zeros(len(docs))
+        for i in range(len(lists.terms)):
+            term_docs = lists.docs(i)
+            if not len(term_docs):
+                continue
+            positions = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+            hit = term_docs[positions] == docs
+            tf = lists.tf(i)[positions[hit]]
+            dots[hit] += tf * lists.idf[i] * lists.weights[i]
+        norms = self.norms[docs + segment.start] * q_norm
+        scores = np.zeros(len(docs))
+        np.divide(dots, norms, out=scores, where=norms > 0)
+        return scores
+
+    def score_segment(
+        self,
+        q_matrix: CSRMatrix,
+        q_norms: np.ndarray,
+        count: int,
+        segment: Segment,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        len_docs = segment.tf.shape[0]
+        # Queries are scored in blocks whose postings and dense score rows stay
+        # small, so a batch never needs more memory than its largest query
+        inside = np.flatnonzero(q_matrix.indices < segment.index.shape[0])
+        terms = q_matrix.indices[inside]
+        lengths = np.zeros(len(q_matrix.indices) + 1, dtype=np.int64)
+        lengths[inside + 1] = (
+            segment.index.indptr[terms + 1] - segment.index.indptr[terms]
+        )
+        postings = np.cumsum(lengths)[q_matrix.indptr]
+        block = max(BLOCK_CELLS // max(len_docs, 1), 1)
+        results = []
+        first = 0
+        while first < q_matrix.shape[0]:
+            last = np.searchsorted(
+                postings, postings[first] + BLOCK_POSTINGS, side="right"
+            )
+            last = min(max(last - 1, first + 1), first + block, q_matrix.shape[0])
+            queries = q_matrix.select_rows(np.arange(first, last))
+            block_rows, docs, scores = self.score_block(
+                queries, q_norms[first:last], count, segment
+            )
+            results.append((block_rows + first, docs, scores))
+            first = last
         return (
-            np.multiply(doc, qry).sum()
-            / np.multiply(doc, doc).sum() ** 0.5
-            * np.multiply(qry, qry).sum() ** 0.5
+            concatenate([result[0] for result in results], np.int64),
+            concatenate([result[1] for result in results], np.int64),
+            concatenate([result[2] for result in results], np.float64),
+        )
+
+    def score_block(
+        self,
+        q_matrix: CSRMatrix,
+        q_norms: np.ndarray,
+        count: int,
+        segment: Segment,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        len_docs = segment.tf.shape[0]
+        # Terms added after this segment was written have no postings in it
+        inside = np.flatnonzero(q_matrix.indices < segment.index.shape[0])
+        terms = q_matrix.indices[inside]
+        owners, docs, tf = segment.index.take_rows(terms)
+        tf = segment.dequantize(terms[owners], tf)
+        cells = (q_matrix.row_ids()[inside] * len_docs)[owners] + docs
+        weights = tf * self.idf[terms][owners] * q_matrix.data[inside][owners]
+        if len(cells) * SPARSE_RATIO < q_matrix.shape[0] * len_docs:
+            cells, inverse = np.unique(cells, return_inverse=True)
+            dots = np.bincount(inverse, weights=weights, minlength=len(cells))
+            live = ~self.deleted[cells % len_docs + segment.start]
+            cells, dots = cells[live], dots[live]
+        else:
+            dots = np.bincount(
+                cells, weights=weights, minlength=q_matrix.shape[0] * len_docs
+            )
+            matched = np.zeros(len(dots), dtype=bool)
+            matched[cells] = True
+            matched.reshape(-1, len_docs)[:] &= ~self.deleted[
+                segment.start : segment.end
+            ]
+            cells = np.flatnonzero(matched)
+            dots = dots[cells]
+        rows, docs = np.divmod(cells, len_docs)
+        docs += segment.start
+        norms = self.norms[docs] * q_norms[rows]
+        scores = np.zeros(len(cells))
+        np.divide(dots, norms, out=scores, where=norms > 0)
+        bounds = np.searchsorted(rows, np.arange(q_matrix.shape[0] + 1))
+        selected = concatenate(
+            [
+                top_k(np.arange(start, end), scores[start:end], count)[0]
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ],
+            np.int64,
         )
+        return rows[selected], docs[selected], scores[selected]
+
+    def rank(
+        self,
+        candidates: np.ndarray,
+        scores: np.ndarray,
+        count: int,
+    ) -> List[Tuple[int, float]]:
+        ids, scores = top_k(candidates, scores, count)
+        if len(ids) < count:
+            missing = self.unmatched(candidates, count - len(ids))
+            ids = np.concatenate([ids, missing])
+            scores = np.concatenate([scores, np.zeros(len(missing))])
+        return list(zip(ids.tolist(), scores.tolist()))
+
+    def unmatched(self, candidates: np.ndarray, count: int) -> np.ndarray:
+        # At most len(candidates) live ids are skipped, so the deleted flags
+        # are walked in growing slices instead of over the whole corpus
+        ids: List[np.ndarray] = []
+        found = start = 0
+        size = count + len(candidates)
+        while found < count and start < len(self.deleted):
+            end = min(start + size, len(self.deleted))
+            live = np.flatnonzero(~self.deleted[start:end]) + start
+            ids.append(live[~np.isin(live, candidates)])
+            found += len(ids[-1])
+            start, size = end, size * 2
+        return concatenate(ids, np.int64)[:count]
+
+
+class PostingLists:
+    def __init__(
+        self,
+        segment: Segment,
+        terms: np.ndarray,
+        weights: np.ndarray,
+        idf: np.ndarray,
+    ):
+        self.segment = segment
+        self.index = segment.index
+        self.terms = terms
+        self.weights = weights
+        self.idf = idf[terms]
+        self.starts = self.index.indptr[terms]
+        self.lengths = self.index.indptr[terms + 1] - self.starts
+
+    def docs(self, i: int) -> np.ndarray:
+        return self.index.indices[self.starts[i] : self.starts[i] + self.lengths[i]]
+
+    def tf(self, i: int) -> np.ndarray:
+        data = self.index.data[self.starts[i] : self.starts[i] + self.lengths[i]]
+        return self.segment.dequantize(self.terms[i], data)
+
+
+def merge_top(
+    ids: np.ndarray,
+    scores: np.ndarray,
+    new_ids: np.ndarray,
+    new_scores: np.ndarray,
+    count: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    return top_k(
+        np.concatenate([ids, new_ids]), np.concatenate([scores, new_scores]), count
+    )
+
+
+def threshold(scores: np.ndarray, count: int) -> float:
+    # Relative slack keeps rounding in the bounds from pruning exact ties
+    if len(scores) < count:
+        return -np.inf
+    return float(scores[-1] - abs(scores[-1]) * 1e-9)
+
+
+def top_k(
+    ids: np.ndarray,
+    scores: np.ndarray,
+    count: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    if count < len(scores):
+        # Every score tied with the last one selected competes on its id
+        kth = np.partition(-scores, max(count, 1) - 1)[max(count, 1) - 1]
+        selected = np.flatnonzero(-scores <= kth)
+    else:
+        selected = np.arange(len(scores))
+    order = selected[np.lexsort((ids[selected], -scores[selected]))][:count]
+    return ids[order], scores[order]
+
+
+def count_terms(terms: Iterable[str], term_ids: Dict[str, int]) -> TermCounts:
+    ids = np.fromiter(
+        (term_ids.setdefault(term, len(term_ids)) for term in terms), dtype=np.int32
+    )
+    ids, counts = np.unique(ids, return_counts=True)
+    return ids, counts.astype(np.int32)
+
+
+def map_counts(
+    terms: List[str], counts: np.ndarray, term_ids: Dict[str, int]
+) -> TermCounts:
+    ids = np.fromiter(
+        (term_ids.setdefault(term, len(term_ids)) for term in terms),
+        dtype=np.int32,
+        count=len(terms),
+    )
+    order = np.argsort(ids)
+    return ids[order], counts[order]
+
+
+def encode(values: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    # Stored frequencies stay non-zero so every posting keeps some weight
+    codes = np.zeros(len(values))
+    np.divide(values, scales, out=codes, where=scales > 0)
+    return np.clip(np.rint(codes), 1, 127).astype(np.int8)
+
+
+def concatenate(arrays: List[np.ndarray], dtype) -> np.ndarray:
+    return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
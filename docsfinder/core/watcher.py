@@ -0,0 +1,48 @@
+import logging
+from threading import Event, Thread
+from typing import Optional
+
+from .engine import Engine
+from .storage import current_version
+
+
+class IndexWatcher:
+    def __init__(self, engine: Engine, root: str = "save", interval: float = 5.0):
+        self.engine = engine
+        self.root = root
+        self.interval = interval
+        # A version that failed to load is not retried until CURRENT moves on
+        self.failed: Optional[str] = None
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self) -> "IndexWatcher":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        # Nothing may stop the thread, the next check could find a good index
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Index check failed")
+
+    def check(self) -> bool:
+        try:
+            version = current_version(self.root)
+        except FileNotFoundError:
+            return False
+        if version in (self.engine.version, self.failed):
+            return False
+        try:
+            self.engine.load(version, self.root)
+        except Exception:
+            self.failed = version
+            logging.exception(f"Index {version} could not be loaded")
+            return False
+        logging.info(f"Index {version} loaded")
+        return True
@@ -1,11 +1,18 @@
 from typing import Optional
 
 from .core.engine import Engine
+from .core.scheduler import QueryScheduler
+from .core.watcher import IndexWatcher
 
 
 class Dependencies:
     def __init__(self):
         self.engine: Optional[Engine] = None
+        self.scheduler: Optional[QueryScheduler] = None
+        self.watcher: Optional[IndexWatcher] = None
+        self.server_timing = False
+        self.slow_query_seconds: Optional[float] = None
+        self.admin_token: Optional[str] = None
 
 
 dependencies = Dependencies()
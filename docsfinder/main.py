@@ -1,15 +1,44 @@
+import gc
 import logging
+import os
+from datetime import datetime
 from os.path import join
+from time import perf_counter
+from typing import List, Optional
 
 import typer
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 
 from .api.main import api
-from .core.engine import Engine
+from .core.benchmark import (
+    compare,
+    load_results,
+    quantization_report,
+    run_benchmarks,
+    save_results,
+)
+from .core.engine import Engine, served_versions
+from .core.evaluation import load_queries
+from .core.metrics import REGISTRY, Timings, server_timing, timings
+from .core.scheduler import QueryScheduler
+from .core.storage import KEEP_VERSIONS
+from .core.tuning import (
+    DEFAULT_SETTING,
+    PARAMETERS,
+    Tuner,
+    best,
+    grid,
+    load_setting,
+    sample,
+)
+from .core.watcher import IndexWatcher
 from .dependencies import dependencies
 
+PROMETHEUS_TEXT = "text/plain; version=0.0.4"
+TRUE = {"1", "true", "yes"}
+
 app = FastAPI(docs_url=None, redoc_url=None)
 
 app.mount("/api", api)
@@ -30,12 +59,108 @@ def index(request: Request):
     return RedirectResponse(join(request.url.path, "api", ""))
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(REGISTRY.render() + "\n", media_type=PROMETHEUS_TEXT)
+
+
+@app.get("/health/live", include_in_schema=False)
+def live():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", include_in_schema=False)
+def ready():
+    engine = dependencies.engine
+    if engine is None or not engine.ready:
+        return JSONResponse({"status": "loading"}, status_code=503)
+    return {"status": "ready", "version": engine.version}
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    request_timings: Timings = []
+    token = timings.set(request_timings)
+    start = perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        timings.reset(token)
+    elapsed = perf_counter() - start
+    if dependencies.server_timing:
+        request_timings.append(("total", elapsed))
+        response.headers["Server-Timing"] = server_timing(request_timings)
+    threshold = dependencies.slow_query_seconds
+    if threshold is not None and elapsed > threshold:
+        stages = ", ".join(
+            f"{name}={seconds:.4f}s" for name, seconds in request_timings
+        )
+        logging.warning(
+            f"Slow request {request.method} {request.url} took {elapsed:.4f}s "
+            + f"({stages})"
+        )
+    return response
+
+
+@app.middleware("http")
+async def index_version(request: Request, call_next):
+    versions: List[Optional[str]] = []
+    token = served_versions.set(versions)
+    try:
+        response = await call_next(request)
+    finally:
+        served_versions.reset(token)
+    # A query answered from the previous index reports that index
+    if not versions and dependencies.engine is not None:
+        versions.append(dependencies.engine.version)
+    if versions and versions[-1] is not None:
+        response.headers["X-Index-Version"] = versions[-1]
+    return response
+
+
 @app.on_event("startup")
 def startup_event():
-    logging.info("Loading model ...")
-    dependencies.engine = Engine()
-    dependencies.engine.load()
-    logging.info("Model loaded")
+    dependencies.server_timing = os.getenv("DOCSFINDER_SERVER_TIMING", "") in TRUE
+    slow_query_seconds = os.getenv("DOCSFINDER_SLOW_QUERY_SECONDS")
+    if slow_query_seconds:
+        dependencies.slow_query_seconds = float(slow_query_seconds)
+    dependencies.admin_token = os.getenv("DOCSFINDER_ADMIN_TOKEN") or None
+    if dependencies.engine is None:
+        logging.info("Loading model ...")
+        create_engine(background=True)
+        logging.info("Model loaded, the tokenizer is loading in the background")
+    batch_window = float(os.getenv("DOCSFINDER_BATCH_WINDOW", "0"))
+    if batch_window > 0:
+        dependencies.scheduler = QueryScheduler(dependencies.engine, batch_window)
+    watch_seconds = os.getenv("DOCSFINDER_WATCH_SECONDS")
+    if watch_seconds:
+        dependencies.watcher = IndexWatcher(
+            dependencies.engine, interval=float(watch_seconds)
+        ).start()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    if dependencies.watcher is not None:
+        dependencies.watcher.stop()
+
+
+def create_engine(background: bool = False):
+    pruning = os.getenv("DOCSFINDER_PRUNING", "") in TRUE
+    # The output of the tune command, its best setting is applied to queries
+    query_settings = os.getenv("DOCSFINDER_QUERY_SETTINGS")
+    repeats, setting = load_setting(query_settings) if query_settings else (False, None)
+    engine = Engine(pruning=pruning, query_repeats=repeats, query_setting=setting)
+    # A failed load leaves no half-built engine for startup to take as loaded
+    engine.load(background=background)
+    dependencies.engine = engine
+
+
+# With gunicorn --preload the master loads the engine once and the forked
+# workers share its pages, frozen objects are never touched by their GC
+if os.getenv("DOCSFINDER_PRELOAD", "") in TRUE:
+    create_engine()
+    gc.freeze()
 
 
 typer_app = typer.Typer()
@@ -66,59 +191,234 @@ def load():
 
 
 @typer_app.command()
-def save(data: str):
+def save(
+    data: str,
+    n_process: int = -1,
+    chunk_size: int = 1000,
+    shards: int = 1,
+    latent_rank: Optional[int] = None,
+    rerank: int = 0,
+    quantization: str = "float64",
+    analysis_cache: Optional[str] = None,
+    keep_versions: int = KEEP_VERSIONS,
+):
     typer.echo("Loading ...")
-    engine = Engine()
-    engine.train(data)
+    engine = Engine(
+        shards=shards,
+        latent_rank=latent_rank,
+        rerank=rerank,
+        quantization=quantization,
+        analysis_cache=analysis_cache,
+        keep_versions=keep_versions,
+    )
+    engine.train(data, n_process=n_process, chunk_size=chunk_size)
     typer.echo("Loaded")
     engine.save()
 
 
 @typer_app.command()
-def save_all():
-    save("data/all_data.json")
+def save_all(n_process: int = -1, shards: int = 1):
+    save("data/all_data.json", n_process, shards=shards)
 
 
 @typer_app.command()
-def save_cisi():
-    save("data/cisi_data.json")
+def save_cisi(n_process: int = -1, shards: int = 1):
+    save("data/cisi_data.json", n_process, shards=shards)
 
 
 @typer_app.command()
-def save_cran():
-    save("data/cran_data.json")
+def save_cran(n_process: int = -1, shards: int = 1):
+    save("data/cran_data.json", n_process, shards=shards)
+
+
+LABELS = {
+    "precision": "Precision",
+    "recall": "Recall",
+    "f": "F",
+    "fallout": "Fallout",
+    "map": "MAP",
+    "ndcg": "nDCG@k",
+    "mrr": "MRR",
+}
 
 
 @typer_app.command()
-def test(data: str, query: str, top: int = 10):
+def test(
+    data: str,
+    query: str,
+    top: int = 10,
+    n_process: int = -1,
+    report: Optional[str] = None,
+    latent_rank: Optional[int] = None,
+    rerank: int = 0,
+    pruning: bool = False,
+    quantization: str = "float64",
+    analysis_cache: Optional[str] = None,
+    query_settings: Optional[str] = None,
+):
     typer.echo("Loading ...")
-    engine = Engine()
-    engine.train(data)
+    repeats, setting = load_setting(query_settings) if query_settings else (False, None)
+    engine = Engine(
+        latent_rank=latent_rank,
+        rerank=rerank,
+        pruning=pruning,
+        quantization=quantization,
+        analysis_cache=analysis_cache,
+        query_repeats=repeats,
+        query_setting=setting,
+    )
+    engine.train(data, n_process=n_process)
     typer.echo("Loaded")
-    typer.echo("Running Precision test ...")
-    precision = engine.test_precision(query, top)
-    typer.echo(f"Precision: {precision}")
-    typer.echo("Running Recall test ...")
-    recall = engine.test_recall(query, top)
-    typer.echo(f"Recall: {recall}")
-    typer.echo("Running F test ...")
-    f = engine.test_f(precision=precision, recall=recall)
-    typer.echo(f"F: {f}")
-    typer.echo("Running Fallout test ...")
-    fallout = engine.test_recall(query, top)
-    typer.echo(f"Fallout: {fallout}")
+    typer.echo("Running evaluation ...")
+    start = perf_counter()
+    evaluation = engine.evaluate(query, top)
+    typer.echo(
+        f"Evaluated {len(evaluation.queries)} queries in {perf_counter() - start:.2f}s"
+    )
+    for name, value in evaluation.summary().items():
+        typer.echo(f"{LABELS[name]}: {value}")
+    if report:
+        evaluation.write_report(report)
+        typer.echo(f"Report written to {report}")
+
+
+@typer_app.command()
+def test_all(top: int = 10, n_process: int = -1, report: Optional[str] = None):
+    test("data/all_data.json", "data/all_query.json", top, n_process, report)
+
+
+@typer_app.command()
+def test_cisi(top: int = 10, n_process: int = -1, report: Optional[str] = None):
+    test("data/cisi_data.json", "data/cisi_query.json", top, n_process, report)
 
 
 @typer_app.command()
-def test_all(top: int = 10):
-    test("data/all_data.json", "data/all_query.json", top)
+def test_cran(top: int = 10, n_process: int = -1, report: Optional[str] = None):
+    test("data/cran_data.json", "data/cran_query.json", top, n_process, report)
 
 
 @typer_app.command()
-def test_cisi(top: int = 10):
-    test("data/cisi_data.json", "data/cisi_query.json", top)
+def quantization(
+    data: str,
+    query: str,
+    mode: List[str] = typer.Option(["float32", "float16", "int8"]),
+    top: int = 10,
+    n_process: int = -1,
+    analysis_cache: Optional[str] = None,
+):
+    typer.echo("Loading ...")
+    engine = Engine(analysis_cache=analysis_cache)
+    engine.train(data, n_process=n_process)
+    typer.echo("Loaded")
+    queries = engine.tokenizer.tokenize_queries(
+        [query.text for query in load_queries(query)], engine.vectorizer.term_ids
+    )
+    report = quantization_report(
+        engine.vectorizer, [list(tokens) for tokens in queries], mode, top
+    )
+    for name, metrics in report.items():
+        typer.echo(name)
+        for metric, value in metrics.items():
+            typer.echo(f"    {metric}: {value:.4g}")
 
 
 @typer_app.command()
-def test_cran(top: int = 10):
-    test("data/cran_data.json", "data/cran_query.json", top)
+def benchmark(
+    corpus: List[str] = typer.Option(["cisi", "cran", "all"]),
+    scale: List[int] = typer.Option([1]),
+    synthetic: List[int] = typer.Option([10, 100]),
+    n_process: int = -1,
+    output: Optional[str] = None,
+    baseline: Optional[str] = None,
+    tolerance: float = 0.1,
+):
+    results = run_benchmarks(corpus, scale, n_process)
+    if synthetic:
+        synthetic_results = run_benchmarks(["all"], synthetic, n_process)
+        results["results"].update(synthetic_results["results"])
+    if output is None:
+        os.makedirs("benchmarks", exist_ok=True)
+        timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = join("benchmarks", f"{timestamp}.json")
+    save_results(results, output)
+    typer.echo(f"Results written to {output}")
+    for name, metrics in results["results"].items():
+        typer.echo(name)
+        for metric, value in metrics.items():
+            typer.echo(f"    {metric}: {value:.4g}")
+    if baseline:
+        regressions = compare(results, load_results(baseline), tolerance)
+        for regression in regressions:
+            typer.echo(f"Regression: {regression}")
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+@typer_app.command()
+def tune(
+    data: str,
+    query: str,
+    a: List[float] = typer.Option([0.0, 0.2, 0.4, 0.6, 0.8, 1.0]),
+    rocchio_a: List[float] = typer.Option([1.0]),
+    b: List[float] = typer.Option([0.75]),
+    y: List[float] = typer.Option([0.15]),
+    feedback: int = 0,
+    repeats: bool = False,
+    samples: int = 0,
+    seed: int = 0,
+    metric: str = "map",
+    top: int = 10,
+    n_process: int = -1,
+    processes: int = 1,
+    output: Optional[str] = None,
+    analysis_cache: Optional[str] = None,
+):
+    typer.echo("Loading ...")
+    engine = Engine(analysis_cache=analysis_cache)
+    engine.train(data, n_process=n_process)
+    typer.echo("Loaded")
+    queries = load_queries(query)
+    _, vectorizer, documents = engine.snapshot()
+    queries_tokens = engine.tokenizer.tokenize_queries(
+        [query.text for query in queries], vectorizer.term_ids, repeats
+    )
+    tuner = Tuner(vectorizer, queries, queries_tokens, documents.ids, top, feedback)
+    values = {"a": a, "rocchio_a": rocchio_a, "b": b, "y": y}
+    # Without repeated stems every query term counts once and a changes nothing,
+    # without feedback the Rocchio coefficients change nothing
+    if not repeats:
+        values.update(a=[DEFAULT_SETTING["a"]])
+    if not feedback:
+        values.update(
+            {name: [DEFAULT_SETTING[name]] for name in ("rocchio_a", "b", "y")}
+        )
+    settings = sample(values, samples, seed) if samples else grid(values)
+    typer.echo(f"Evaluating {len(settings)} settings ...")
+    start = perf_counter()
+    summaries = tuner.run(settings, processes)
+    typer.echo(f"Evaluated in {perf_counter() - start:.2f}s")
+    names = list(PARAMETERS) + list(LABELS)
+    typer.echo(" ".join(f"{LABELS.get(name, name):>9}" for name in names))
+    for setting, summary in zip(settings, summaries):
+        row = {**setting, **summary}
+        typer.echo(" ".join(f"{row[name]:>9.4f}" for name in names))
+    index = best(settings, summaries, metric)
+    typer.echo(
+        f"Best {LABELS[metric]}: {summaries[index][metric]:.4f} with "
+        + ", ".join(f"{name}={value:.4g}" for name, value in settings[index].items())
+    )
+    if output:
+        save_results(
+            {
+                "metric": metric,
+                "repeats": repeats,
+                "best": settings[index],
+                "results": [
+                    {"setting": setting, "metrics": summary}
+                    for setting, summary in zip(settings, summaries)
+                ],
+            },
+            output,
+        )
+        typer.echo(f"Results written to {output}")
+        typer.echo(f"Serve the best setting with DOCSFINDER_QUERY_SETTINGS={output}")
@@ -0,0 +1,34 @@
+from docsfinder.core.benchmark import compare, scale_documents
+from docsfinder.core.models import Document
+
+
+def test_scaled_corpus_is_reproducible():
+    documents = [
+        Document(id=str(i), title="Title", content=f"one two three {i}")
+        for i in range(3)
+    ]
+    scaled = list(scale_documents(documents, 3))
+    assert len(scaled) == 9
+    assert scaled[:3] == documents
+    assert len({document.id for document in scaled}) == 9
+    assert scaled == list(scale_documents(documents, 3))
+    assert sorted(scaled[3].content.split()) == sorted(documents[0].content.split())
+
+
+def test_regressions_are_flagged():
+    baseline = {"results": {"cisi": {"train_seconds": 1.0, "query_p50_ms": 5.0}}}
+    baseline["results"]["cisi"]["batch_queries_per_second"] = 100.0
+    results = {
+        "results": {
+            "cisi": {
+                "train_seconds": 1.05,
+                "query_p50_ms": 7.0,
+                "batch_queries_per_second": 80.0,
+            },
+            "cran": {"train_seconds": 9.0},
+        }
+    }
+    regressions = compare(results, baseline, tolerance=0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("cisi query_p50_ms")
+    assert regressions[1].startswith("cisi batch_queries_per_second")
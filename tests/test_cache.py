@@ -0,0 +1,44 @@
+from time import sleep
+
+import numpy as np
+
+from docsfinder.core.cache import AnalysisCache, QueryCache
+
+
+def test_cache_evicts_least_recently_used():
+    cache = QueryCache(max_entries=2)
+    cache.put("a", [(0, 1.0)])
+    cache.put("b", [(1, 1.0)])
+    assert cache.get("a") == [(0, 1.0)]
+    cache.put("c", [(2, 1.0)])
+    assert cache.get("b") is None
+    assert cache.get("c") == [(2, 1.0)]
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (2, 1, 1)
+
+
+def test_cache_expires_and_clears():
+    cache = QueryCache(ttl=0.01)
+    cache.put("a", [(0, 1.0)])
+    sleep(0.02)
+    assert cache.get("a") is None
+    cache = QueryCache()
+    cache.put("a", [(0, 1.0)])
+    cache.clear()
+    assert cache.get("a") is None
+    assert cache.stats().bytes == 0
+
+
+def test_analysis_cache_persists_by_content_and_settings(tmp_path):
+    path = str(tmp_path / "analysis.sqlite")
+    cache = AnalysisCache(path, "settings", batch_size=2)
+    key = cache.key("Title content")
+    assert cache.get(key) is None
+    cache.put(key, (["titl", "content"], np.array([1, 2])))
+    cache.close()
+    reopened = AnalysisCache(path, "settings")
+    terms, counts = reopened.get(key)
+    assert terms == ["titl", "content"]
+    assert counts.tolist() == [1, 2]
+    assert (reopened.hits, reopened.misses) == (1, 0)
+    assert AnalysisCache(path, "other settings").key("Title content") != key
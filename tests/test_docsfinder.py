@@ -1,6 +1,10 @@
+import pytest
 from fastapi.testclient import TestClient
 
-from docsfinder.main import app
+from docsfinder.core.engine import Engine
+from docsfinder.core.storage import IndexFormatError
+from docsfinder.dependencies import dependencies
+from docsfinder.main import app, create_engine
 
 
 def test_redirections():
@@ -29,3 +33,56 @@ def test_query_with_feedback():
         query = "query=Random query for test&good_feedback=0&bad_feedback=1"
         response = client.get(f"{url}?{query}")
         assert response.status_code == 200
+        url = "/api/v1/query-with-feedback"
+        assert client.get(f"{url}?{query}").status_code == 200
+        query = "query=Random query for test&good_feedback=-1&bad_feedback=1"
+        assert client.get(f"{url}?{query}").status_code == 200
+        query = "query=Random query for test&good_feedback=0&bad_feedback=1000000"
+        assert client.get(f"{url}?{query}").status_code == 422
+
+
+def test_query_batch():
+    with TestClient(app) as client:
+        url = "/api/v1/query/batch"
+        body = {"queries": ["Random query for test", "Another query"], "count": 5}
+        response = client.post(url, json=body)
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        assert client.post(url, json={**body, "count": -1}).status_code == 422
+        body = {"queries": ["query"] * 1000}
+        assert client.post(url, json=body).status_code == 422
+
+
+def test_health():
+    with TestClient(app) as client:
+        assert client.get("/health/live").status_code == 200
+        response = client.get("/health/ready")
+        assert response.status_code in (200, 503)
+        if response.status_code == 200:
+            assert response.json()["status"] == "ready"
+
+
+def test_index_updates_need_the_admin_token(monkeypatch):
+    with TestClient(app) as client:
+        assert client.delete("/api/v1/documents?ids=0").status_code == 403
+        assert client.post("/api/v1/save").status_code == 403
+        assert client.post("/api/v1/index/reload").status_code == 403
+    monkeypatch.setenv("DOCSFINDER_ADMIN_TOKEN", "secret")
+    with TestClient(app) as client:
+        url = "/api/v1/documents/merge"
+        assert client.post(url).status_code == 401
+        headers = {"Authorization": "Bearer wrong"}
+        assert client.post(url, headers=headers).status_code == 401
+        headers = {"Authorization": "Bearer secret"}
+        assert client.post(url, headers=headers).status_code == 200
+
+
+def test_failed_loads_leave_no_engine(monkeypatch):
+    def load(engine: Engine, background: bool = False):
+        raise IndexFormatError("Index format 3, expected 5")
+
+    monkeypatch.setattr(dependencies, "engine", None)
+    monkeypatch.setattr(Engine, "load", load)
+    with pytest.raises(IndexFormatError):
+        create_engine()
+    assert dependencies.engine is None
@@ -0,0 +1,48 @@
+import json
+from math import log2
+
+import numpy as np
+
+from docsfinder.core.evaluation import evaluate, f_measure, ranking_agreement
+from docsfinder.core.models import Query
+
+
+def query(id: str, docs):
+    return Query(id=id, text=id, docs=docs)
+
+
+def test_ranking_metrics():
+    queries = [query("q1", ["a", "c", "e"]), query("q2", ["z"])]
+    rankings = [["a", "b", "c", "d"], ["b", "a", "c", "d"]]
+    metrics = evaluate(queries, rankings, documents=10, top=4).metrics
+    assert np.allclose(metrics["precision"], [(1 + 2 / 3) / 2, 0])
+    assert np.allclose(metrics["recall"], [(1 / 3 + 2 / 3) / 2, 0])
+    assert np.allclose(metrics["average_precision"], [(1 + 2 / 3) / 3, 0])
+    assert np.allclose(metrics["reciprocal_rank"], [1, 0])
+    ideal = 1 + 1 / log2(3) + 1 / log2(4)
+    assert np.allclose(metrics["ndcg"], [(1 + 1 / log2(4)) / ideal, 0])
+    assert np.allclose(metrics["fallout"], [(0 + 1 + 1 + 2) / 4 / 7, 2.5 / 9])
+
+
+def test_summary_and_report(tmp_path):
+    queries = [query("q1", ["a"]), query("q2", ["b"])]
+    evaluation = evaluate(queries, [["a", "b"], ["a"]], documents=5, top=2)
+    summary = evaluation.summary()
+    assert summary["precision"] == 0.5
+    assert summary["mrr"] == 0.5
+    assert summary["f"] == f_measure(summary["precision"], summary["recall"])
+    evaluation.write_report(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as file:
+        report = json.load(file)
+    assert [item["id"] for item in report] == ["q1", "q2"]
+    assert report[1]["retrieved"] == ["a"]
+    assert report[1]["reciprocal_rank"] == 0
+
+
+def test_ranking_agreement():
+    reference = [[1, 2, 3], [4, 5, 6]]
+    agreement = ranking_agreement(reference, [[1, 3, 2], [5, 4, 7]], top=3)
+    assert agreement["overlap"] == (1 + 2 / 3) / 2
+    assert agreement["top1"] == 0.5
+    assert agreement["identical"] == 0
+    assert ranking_agreement(reference, reference)["identical"] == 1
@@ -0,0 +1,28 @@
+import json
+
+from docsfinder.core.ingest import chunks, read_documents
+
+ITEMS = [
+    {"id": "1", "title": "Library catalogs", "content": "Catalog systems"},
+    {"id": "2", "title": "Missing content"},
+    {"id": "3", "title": "Wing flow", "content": "Aerodynamic flow"},
+]
+
+
+def test_read_documents_from_jsonl_directory(tmp_path):
+    with open(tmp_path / "a.jsonl", mode="w") as file:
+        file.write("\n".join(json.dumps(item) for item in ITEMS[:2]) + "\n\n")
+    with open(tmp_path / "b.json", mode="w") as file:
+        json.dump(ITEMS[2:], file)
+    (tmp_path / "notes.txt").write_text("ignored")
+    documents = list(read_documents(str(tmp_path)))
+    assert [document.id for document in documents] == ["1", "3"]
+
+
+def test_read_documents_from_iterator():
+    documents = read_documents(item for item in ITEMS)
+    assert [document.id for document in documents] == ["1", "3"]
+
+
+def test_chunks():
+    assert list(chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,42 @@
+from docsfinder.core.metrics import Counter, Histogram, server_timing, stage, timings
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency.", ("stage",), (0.1, 1.0))
+    for value in [0.05, 0.5, 0.7, 3.0]:
+        histogram.observe(value, "rank")
+    lines = histogram.render()
+    assert lines[:2] == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+    ]
+    assert lines[2:5] == [
+        'latency_seconds_bucket{stage="rank",le="0.1"} 1',
+        'latency_seconds_bucket{stage="rank",le="1.0"} 3',
+        'latency_seconds_bucket{stage="rank",le="+Inf"} 4',
+    ]
+    assert lines[6] == 'latency_seconds_count{stage="rank"} 4'
+
+
+def test_counter_renders_labelled_values():
+    counter = Counter("queries_total", "Queries.", ("operation",))
+    counter.inc("find")
+    counter.inc("find_many", amount=3)
+    assert counter.render()[2:] == [
+        'queries_total{operation="find"} 1',
+        'queries_total{operation="find_many"} 3',
+    ]
+
+
+def test_stages_are_recorded_for_the_current_request():
+    with stage("find", "tokenize"):
+        pass
+    request_timings = []
+    token = timings.set(request_timings)
+    try:
+        with stage("find", "similarity"):
+            pass
+    finally:
+        timings.reset(token)
+    assert [name for name, _ in request_timings] == ["find-similarity"]
+    assert server_timing([("total", 0.0125)]) == "total;dur=12.500"
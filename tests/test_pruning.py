@@ -0,0 +1,32 @@
+import re
+from typing import List
+
+import pytest
+
+from docsfinder.core.evaluation import load_queries
+from docsfinder.core.ingest import read_documents
+from docsfinder.core.metrics import PRUNING_DOCUMENTS
+from docsfinder.core.vectorizer import Vectorizer
+
+
+def words(text: str) -> List[str]:
+    return re.findall(r"[a-z]+", text.lower())
+
+
+@pytest.mark.parametrize("corpus", ["cisi", "cran"])
+def test_pruned_top_k_matches_exhaustive(corpus):
+    docs = [
+        words(f"{document.title} {document.content}")
+        for document in read_documents(f"data/{corpus}_data.json")
+    ]
+    texts = [words(query.text) for query in load_queries(f"data/{corpus}_query.json")]
+    exhaustive = Vectorizer(shards=2)
+    exhaustive.train(docs)
+    pruned = Vectorizer(shards=2, pruning=True)
+    pruned.train(docs)
+    skipped = PRUNING_DOCUMENTS.values.get(("skipped",), 0)
+    for count in [0, 1, 10]:
+        assert pruned.query_many(texts, count=count) == exhaustive.query_many(
+            texts, count=count
+        )
+    assert PRUNING_DOCUMENTS.values.get(("skipped",), 0) > skipped
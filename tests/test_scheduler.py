@@ -0,0 +1,45 @@
+import asyncio
+from typing import List
+
+from docsfinder.core.scheduler import QueryScheduler
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.batches: List[List[str]] = []
+
+    def find(self, query: str, count: int = 10):
+        return self.find_many([query], count)[0]
+
+    def find_many(self, queries: List[str], count: int = 10):
+        self.batches.append(queries)
+        return [[f"{query}:{count}"] for query in queries]
+
+
+def test_queries_are_batched_while_one_is_running():
+    engine = RecordingEngine()
+    scheduler = QueryScheduler(engine, window=0.05, max_batch=8)
+
+    async def run():
+        return await asyncio.gather(
+            *(scheduler.find(f"query {i}", count=5) for i in range(5))
+        )
+
+    results = asyncio.run(run())
+    assert results == [[f"query {i}:5"] for i in range(5)]
+    assert engine.batches == [["query 0"], [f"query {i}" for i in range(1, 5)]]
+    stats = scheduler.stats()
+    assert (stats.batches, stats.queries, stats.pending, stats.running) == (2, 5, 0, 0)
+
+
+def test_full_batches_are_flushed_without_waiting():
+    engine = RecordingEngine()
+    scheduler = QueryScheduler(engine, window=60, max_batch=2)
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(*(scheduler.find(str(i)) for i in range(4))), 5
+        )
+
+    assert len(asyncio.run(run())) == 4
+    assert engine.batches == [["0"], ["1", "2"], ["3"]]
@@ -0,0 +1,111 @@
+import json
+
+import numpy as np
+import pytest
+
+from docsfinder.core.models import Document
+from docsfinder.core.storage import (
+    FORMAT_VERSION,
+    IndexFormatError,
+    load_index,
+    remove_old_versions,
+    save_index,
+    saved_versions,
+)
+from docsfinder.core.store import DocumentStore, build_store
+
+
+def test_index_roundtrip(tmp_path):
+    root = str(tmp_path)
+    arrays = {"idf": np.arange(5, dtype=float), "weights.indptr": np.arange(3)}
+    version = save_index(arrays, {"terms.txt": b"a\nb"}, {"key": "value"}, root)
+    loaded_version, loaded, files, metadata = load_index(root, verify=True)
+    assert loaded_version == version
+    assert metadata == {"key": "value"}
+    assert isinstance(loaded["idf"], np.memmap)
+    assert np.array_equal(loaded["idf"], arrays["idf"])
+    assert np.array_equal(loaded["weights.indptr"], arrays["weights.indptr"])
+    assert files["terms.txt"][:] == b"a\nb"
+
+
+def test_truncated_index_is_rejected(tmp_path):
+    root = str(tmp_path)
+    version = save_index({"idf": np.arange(5, dtype=float)}, {}, root=root)
+    with open(tmp_path / version / "idf.npy", mode="r+b") as file:
+        file.truncate(16)
+    with pytest.raises(IndexFormatError):
+        load_index(root)
+    manifest = tmp_path / version / "manifest.json"
+    content = json.loads(manifest.read_text())
+    manifest.write_text(json.dumps({**content, "format": FORMAT_VERSION - 1}))
+    with pytest.raises(IndexFormatError, match="format"):
+        load_index(root, version)
+    manifest.unlink()
+    with pytest.raises(IndexFormatError):
+        load_index(root, version)
+
+
+def test_versions_outside_the_root_are_rejected(tmp_path):
+    root = tmp_path / "save"
+    save_index({"idf": np.arange(5, dtype=float)}, {}, root=str(root))
+    other = save_index(
+        {"idf": np.arange(5, dtype=float)}, {}, root=str(tmp_path / "other")
+    )
+    for version in ["..", f"../other/{other}", "/etc", "a\\..\\b", ""]:
+        with pytest.raises(IndexFormatError):
+            load_index(str(root), version)
+
+
+def test_only_the_latest_versions_are_kept(tmp_path):
+    root = str(tmp_path)
+    arrays = {"idf": np.arange(5, dtype=float)}
+    versions = [save_index(arrays, {}, root=root, keep=2) for _ in range(4)]
+    assert saved_versions(root) == versions[2:]
+    assert not (tmp_path / versions[0]).exists()
+    # A version CURRENT was rolled back to is never removed
+    (tmp_path / "CURRENT").write_text(versions[2])
+    assert remove_old_versions(root, keep=1) == []
+    (tmp_path / "CURRENT").write_text(versions[3])
+    assert remove_old_versions(root, keep=1) == [versions[2]]
+    assert saved_versions(root) == versions[3:]
+
+
+def test_document_store_decodes_single_records():
+    documents = [
+        Document(id=str(i), title=f"Title {i}", content="Content " * i)
+        for i in range(5)
+    ]
+    for compression in ["zlib", None]:
+        store = build_store(documents, compression)
+        assert len(store) == len(documents)
+        assert store[3] == documents[3]
+        assert store[-1] == documents[-1]
+        assert list(store) == documents
+
+
+def test_document_store_append_and_select():
+    documents = [
+        Document(id=str(i), title=f"Title {i}", content="Content " * i)
+        for i in range(5)
+    ]
+    first = build_store(documents[:3])
+    store = first.append(documents[3:4]).append([]).append(documents[4:])
+    assert list(store) == documents
+    assert store.ids == [document.id for document in documents]
+    # Appends write their own segment and leave the previous records alone
+    assert [segment.start for segment in store.segments] == [0, 3, 4]
+    assert store.segments[0].records is first.segments[0].records
+    selected = store.select(np.array([1, 4, 3]))
+    assert list(selected) == [documents[1], documents[4], documents[3]]
+    assert selected.ids == ["1", "4", "3"]
+    assert len(selected.segments) == 1
+
+
+def test_document_store_segments_are_saved(tmp_path):
+    documents = [Document(id=str(i), title="Title", content="") for i in range(4)]
+    store = build_store([]).append(documents[:1]).append(documents[1:])
+    save_index(store.to_arrays(), store.to_files(), root=str(tmp_path))
+    _, arrays, files, _ = load_index(str(tmp_path))
+    loaded = DocumentStore.from_arrays(arrays, files, store.ids, store.compression)
+    assert [segment.start for segment in loaded.segments] == [0, 1]
+    assert list(loaded) == documents
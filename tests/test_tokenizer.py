@@ -0,0 +1,95 @@
+import json
+from glob import glob
+from itertools import chain
+from typing import List, Set
+
+import pytest
+
+from docsfinder.core.cache import AnalysisCache
+from docsfinder.core.tokenizer import Tokenizer, fingerprint, preprocess
+
+
+@pytest.fixture(scope="module")
+def tokenizer() -> Tokenizer:
+    return Tokenizer()
+
+
+@pytest.mark.parametrize("filename", sorted(glob("data/*_query.json")))
+def test_tokenize_queries_matches_spacy(tokenizer: Tokenizer, filename: str):
+    with open(filename) as file:
+        texts = [item["text"] for item in json.load(file)]
+    expected = [tokenizer.tokenize(text, remove_stopwords=False) for text in texts]
+    assert tokenizer.tokenize_queries(texts) == expected
+
+
+def test_tokenize_query_skips_spacy_for_keywords(tokenizer: Tokenizer):
+    assert tokenizer.lookup_query(["libraries", "of", "catalogs", "library"]) == [
+        "librari",
+        "catalog",
+        "librari",
+    ]
+    assert tokenizer.lookup_query(["books", "can", "help"]) is None
+    assert tokenizer.lookup_query(["books", "can", "help"], {"book"}) == [
+        "book",
+        "help",
+    ]
+
+
+def query_vocabulary(tokenizer: Tokenizer, texts: List[str]) -> Set[str]:
+    return set(chain.from_iterable(tokenizer.tokenize_many(texts)))
+
+
+@pytest.mark.parametrize("filename", sorted(glob("data/*_query.json")))
+def test_tokenize_queries_matches_spacy_in_vocabulary(
+    tokenizer: Tokenizer, filename: str
+):
+    with open(filename) as file:
+        texts = [item["text"] for item in json.load(file)]
+    vocabulary = query_vocabulary(tokenizer, texts)
+    expected = [
+        [term for term in tokenizer.tokenize(text, False, True) if term in vocabulary]
+        for text in texts
+    ]
+    results = tokenizer.tokenize_queries(texts, vocabulary, repeats=True)
+    assert [
+        [term for term in tokens if term in vocabulary] for tokens in results
+    ] == expected
+
+
+def test_most_queries_skip_spacy(tokenizer: Tokenizer):
+    with open("data/all_query.json") as file:
+        texts = [item["text"] for item in json.load(file)]
+    vocabulary = query_vocabulary(tokenizer, texts)
+    results = [
+        tokenizer.lookup_query(preprocess(text).split(), vocabulary) for text in texts
+    ]
+    assert sum(result is not None for result in results) >= len(texts) // 2
+
+
+def test_spacy_is_loaded_on_first_use():
+    tokenizer = Tokenizer()
+    assert not tokenizer.loaded
+    assert tokenizer.tokenize("Libraries and catalogs") == {"librari", "catalog"}
+    assert tokenizer.loaded
+
+
+def test_query_tokens_keep_repeats_only_on_request(tokenizer: Tokenizer):
+    for text in ["Libraries of catalogs of the library", "The book can help books"]:
+        tokens = tokenizer.tokenize_query(text, repeats=True)
+        assert isinstance(tokens, list) and len(tokens) > len(set(tokens))
+        assert tokenizer.tokenize_query(text) == set(tokens)
+
+
+def test_cached_analysis_matches_spacy(tokenizer: Tokenizer, tmp_path):
+    texts = ["Libraries and catalogs of libraries", "Wing flow", "Wing flow"]
+    expected = list(tokenizer.analyze_many(texts, {}))
+    cache = AnalysisCache(str(tmp_path / "analysis.sqlite"), fingerprint())
+    for _ in range(2):
+        results = list(tokenizer.analyze_many(texts, {}, cache=cache))
+        assert [ids.tolist() for ids, _ in results] == [
+            ids.tolist() for ids, _ in expected
+        ]
+        assert [counts.tolist() for _, counts in results] == [
+            counts.tolist() for _, counts in expected
+        ]
+    assert cache.hits == 3
@@ -0,0 +1,69 @@
+import json
+
+from docsfinder.core.evaluation import evaluate
+from docsfinder.core.models import Query
+from docsfinder.core.tuning import Tuner, best, grid, load_setting, sample
+from docsfinder.core.vectorizer import Vectorizer
+
+DOCS = [
+    ["librari", "catalog", "system", "librari"],
+    ["catalog", "index", "retriev"],
+    ["aerodynam", "wing", "flow", "flow", "flow"],
+    ["retriev", "system", "index", "evalu"],
+]
+IDS = ["d0", "d1", "d2", "d3"]
+QUERIES = [
+    Query(id="q0", text="", docs=["d0", "d1"]),
+    Query(id="q1", text="", docs=["d3"]),
+]
+TOKENS = [["catalog", "catalog", "system"], ["index", "evalu", "evalu", "retriev"]]
+
+
+def tuner(feedback: int = 0) -> Tuner:
+    vectorizer = Vectorizer()
+    vectorizer.train(DOCS)
+    return Tuner(vectorizer, QUERIES, TOKENS, IDS, top=2, feedback=feedback)
+
+
+def test_settings_match_separate_evaluations():
+    values = {"a": [0.0, 0.4, 1.0], "rocchio_a": [1.0], "b": [0.75], "y": [0.15]}
+    settings = grid(values)
+    assert len(settings) == 3
+    summaries = tuner().run(settings)
+    for setting, summary in zip(settings, summaries):
+        vectorizer = tuner().vectorizer
+        results = vectorizer.query_many(TOKENS, setting["a"], count=2)
+        rankings = [[IDS[index] for index, _ in result] for result in results]
+        assert summary == evaluate(QUERIES, rankings, len(DOCS), 2).summary()
+    assert summaries[best(settings, summaries)]["map"] == max(
+        summary["map"] for summary in summaries
+    )
+
+
+def test_feedback_settings_in_processes():
+    values = {"a": [0.4], "rocchio_a": [0.5, 1.0], "b": [0.0, 0.75], "y": [0.15]}
+    settings = grid(values) + sample(values, 3)
+    expected = tuner(feedback=2).run(settings)
+    assert tuner(feedback=2).run(settings, processes=2) == expected
+    assert all(0.5 <= setting["rocchio_a"] <= 1.0 for setting in settings)
+
+
+def test_feedback_settings_rerank_like_feedback_queries(tmp_path):
+    values = {"a": [0.0, 1.0], "rocchio_a": [0.5, 1.0], "b": [0.75], "y": [0.5]}
+    filename = tmp_path / "tune.json"
+    filename.write_text(json.dumps({"repeats": True, "best": grid(values)[1]}))
+    assert load_setting(str(filename)) == (True, grid(values)[1])
+    feedback = tuner(feedback=2)
+    vectorizer = feedback.vectorizer
+    for setting in grid(values):
+        q_matrix = vectorizer.vectorize_queries(TOKENS, setting["a"])
+        first = vectorizer.similarity_many(q_matrix, 2)
+        expected = []
+        for i, (tokens, result) in enumerate(zip(TOKENS, first)):
+            judged = [index for index, _ in result]
+            good = [index for index in judged if index in feedback.relevant[i]]
+            bad = [index for index in judged if index not in feedback.relevant[i]]
+            expected.append(
+                vectorizer.query_with_feedback(tokens, good, bad, count=2, **setting)
+            )
+        assert feedback.rerank(q_matrix, first, setting) == expected
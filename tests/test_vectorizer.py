@@ -0,0 +1,238 @@
+from math import log10
+
+import numpy as np
+import pytest
+
+from docsfinder.core import vectorizer as vectorizer_module
+from docsfinder.core.vectorizer import TermStatistics, Vectorizer, count_terms
+
+DOCS = [
+    ["librari", "catalog", "system", "librari"],
+    ["catalog", "index", "retriev"],
+    ["aerodynam", "wing", "flow", "flow", "flow"],
+    ["retriev", "system", "index", "evalu"],
+]
+
+
+def train() -> Vectorizer:
+    vectorizer = Vectorizer()
+    vectorizer.train(DOCS)
+    return vectorizer
+
+
+def test_train_weights():
+    vectorizer = train()
+    terms = vectorizer.terms
+    assert sorted(terms) == sorted({term for doc in DOCS for term in doc})
+    freq = np.array([[doc.count(term) for term in terms] for doc in DOCS], float)
+    idf = np.array([log10(len(DOCS) / np.count_nonzero(col)) for col in freq.T])
+    expected = freq / freq.max(1, keepdims=True) * idf
+    assert np.allclose(vectorizer.idf, idf)
+    assert np.allclose(vectorizer.weights.to_dense(), expected)
+
+
+def test_query_ranks_matching_documents_first():
+    vectorizer = train()
+    results = vectorizer.query(["wing", "flow"])
+    assert len(results) == len(DOCS)
+    assert results[0][0] == 2
+    assert all(score == 0 for _, score in results[1:])
+
+
+def test_query_returns_top_count_from_postings():
+    vectorizer = train()
+    results = vectorizer.query(["catalog", "retriev", "system"], count=3)
+    dense = vectorizer.weights.to_dense()
+    q_vect = vectorizer.vectorize_query(["catalog", "retriev", "system"])
+    dots = dense @ q_vect
+    expected = sorted(
+        range(len(DOCS)), key=lambda i: -dots[i] / np.sqrt(dense[i] @ dense[i])
+    )
+    assert [index for index, _ in results] == expected[:3]
+
+
+@pytest.mark.parametrize("pruning", [False, True])
+def test_short_results_are_padded_with_the_first_live_documents(pruning: bool):
+    vectorizer = Vectorizer(shards=3, pruning=pruning)
+    vectorizer.train(DOCS * 5000 + [["rare"]])
+    vectorizer.delete(np.concatenate([np.arange(15000), np.arange(15001, 15010, 2)]))
+    results = vectorizer.query(["rare"], count=10)
+    assert results[0][0] == 20000 and results[0][1] > 0
+    assert [index for index, _ in results[1:]] == [
+        15000,
+        15002,
+        15004,
+        15006,
+        15008,
+        15010,
+        15011,
+        15012,
+        15013,
+    ]
+    assert all(score == 0 for _, score in results[1:])
+
+
+def test_similarity_scores_are_cosines():
+    vectorizer = train()
+    dense = vectorizer.weights.to_dense()
+    q_vect = vectorizer.vectorize_query(["index", "retriev", "evalu"])
+    for index, score in vectorizer.similarity(q_vect, count=len(DOCS)):
+        doc = dense[index]
+        norm = np.linalg.norm(doc) * np.linalg.norm(q_vect)
+        assert np.isclose(score, doc @ q_vect / norm)
+        assert 0 <= score <= 1
+
+
+def test_query_many_matches_single_queries():
+    vectorizer = train()
+    texts = [["catalog", "system"], ["flow"], ["unknown"], ["index", "retriev"]]
+    results = vectorizer.query_many(texts, count=2)
+    assert results == [vectorizer.query(text, count=2) for text in texts]
+
+
+def test_query_blocks_match_single_queries(monkeypatch):
+    vectorizer = train()
+    texts = [["catalog", "system"], ["flow"], [], ["index", "retriev"], ["wing"]]
+    vectorizer.delete(np.array([1]))
+    expected = [vectorizer.query(text, count=3) for text in texts]
+    for ratio in [0, 1 << 30]:
+        monkeypatch.setattr(vectorizer_module, "SPARSE_RATIO", ratio)
+        for cells, postings in [(len(DOCS), 100), (100, 3), (1, 100)]:
+            monkeypatch.setattr(vectorizer_module, "BLOCK_CELLS", cells)
+            monkeypatch.setattr(vectorizer_module, "BLOCK_POSTINGS", postings)
+            assert vectorizer.query_many(texts, count=3) == expected
+
+
+def test_chunked_statistics_match_single_pass():
+    statistics = TermStatistics()
+    statistics.update(DOCS[:1])
+    statistics.update(DOCS[1:])
+    vectorizer = Vectorizer()
+    vectorizer.fit(statistics)
+    expected = train()
+    assert vectorizer.terms == expected.terms
+    assert np.allclose(vectorizer.weights.to_dense(), expected.weights.to_dense())
+
+
+def test_term_counts_from_another_vocabulary():
+    vocabulary = {}
+    counts = [count_terms(doc, vocabulary) for doc in DOCS]
+    ids, freqs = counts[2]
+    assert ids.dtype == np.int32
+    assert dict(zip(np.array(list(vocabulary))[ids], freqs)) == {
+        "aerodynam": 1,
+        "wing": 1,
+        "flow": 3,
+    }
+    statistics = TermStatistics({"flow": 0})
+    statistics.update_counts(counts, list(vocabulary))
+    expected = TermStatistics({"flow": 0})
+    expected.update(DOCS)
+    assert statistics.term_ids == expected.term_ids
+    assert np.array_equal(statistics.matrix().to_dense(), expected.matrix().to_dense())
+
+
+def test_add_delete_and_merge_match_fresh_training():
+    vectorizer = Vectorizer()
+    vectorizer.train(DOCS[:2])
+    statistics = TermStatistics(vectorizer.term_ids)
+    statistics.update(DOCS[2:])
+    assert vectorizer.add(statistics) == range(2, 4)
+    vectorizer.delete(np.array([1, 3]))
+    expected = Vectorizer()
+    expected.train([DOCS[0], DOCS[2]])
+    ids = [vectorizer.term_ids[term] for term in expected.terms]
+    dense = vectorizer.weights.to_dense()[:, ids]
+    assert np.allclose(vectorizer.idf[ids], expected.idf)
+    assert np.allclose(dense[[0, 2]], expected.weights.to_dense())
+    assert all(
+        index not in (1, 3) for index, _ in vectorizer.query(["catalog"], count=4)
+    )
+    assert np.array_equal(vectorizer.merge(), [0, 2])
+    assert len(vectorizer.segments) == 1
+    assert np.allclose(vectorizer.weights.to_dense()[:, ids], dense[[0, 2]])
+
+
+def test_postings_and_term_ids_are_int32():
+    vectorizer = Vectorizer(shards=2)
+    vectorizer.train(DOCS[:2])
+    statistics = TermStatistics(vectorizer.term_ids)
+    statistics.update(DOCS[2:])
+    vectorizer.add(statistics)
+    vectorizer.delete(np.array([1]))
+    for merge in [False, True]:
+        if merge:
+            vectorizer.merge()
+        for segment in vectorizer.segments:
+            assert segment.tf.indices.dtype == np.int32
+            assert segment.index.indices.dtype == np.int32
+
+
+def test_sharded_queries_match_single_shard():
+    vectorizer = train()
+    sharded = Vectorizer(shards=3)
+    sharded.train(DOCS)
+    assert len(sharded.segments) == 3
+    assert np.allclose(sharded.idf, vectorizer.idf)
+    texts = [["catalog", "system"], ["flow"], ["unknown"], ["index", "retriev"]]
+    for count in [1, 2, 4]:
+        assert sharded.query_many(texts, count=count) == vectorizer.query_many(
+            texts, count=count
+        )
+    sharded.delete(np.array([0]))
+    assert len(sharded.segments) == 3
+    assert [index for index, _ in sharded.query(["catalog"], count=3)] == [1, 2, 3]
+
+
+def test_rocchio_feedback_matches_dense_centroids():
+    vectorizer = train()
+    dense = vectorizer.weights.to_dense()
+    text = ["catalog", "system"]
+    q_vect = vectorizer.vectorize_query(text)
+    q_matrix = vectorizer.vectorize_queries([text])
+    feedback = vectorizer.feedback_rocchio(q_matrix, [1, 3], [2])
+    expected = q_vect + 0.75 * (dense[1] + dense[3]) / 2 - 0.15 * dense[2]
+    assert np.allclose(feedback.to_dense()[0], expected)
+    results = vectorizer.query_with_feedback(text, [1, 3], [2], count=len(DOCS))
+    assert results == vectorizer.similarity(expected, count=len(DOCS))
+    assert np.allclose(vectorizer.row(3), dense[3])
+    negative = vectorizer.feedback_rocchio(q_matrix, [-3, -1], [-2])
+    assert np.allclose(negative.to_dense()[0], expected)
+    with pytest.raises(IndexError):
+        vectorizer.feedback_rocchio(q_matrix, [len(DOCS)], [])
+
+
+def test_latent_scores_rank_like_exact_scores():
+    vectorizer = train()
+    texts = [["catalog", "system"], ["flow"], ["index", "retriev", "evalu"]]
+    expected = vectorizer.query_many(texts, count=2)
+    latent = Vectorizer(latent_rank=len(DOCS))
+    latent.train(DOCS)
+    assert latent.lsi.embeddings.shape == (len(DOCS), len(DOCS))
+    results = latent.query_many(texts, count=2)
+    assert [result[0][0] for result in results] == [result[0][0] for result in expected]
+    latent.rerank = len(DOCS)
+    for result, exact in zip(latent.query_many(texts, count=2), expected):
+        assert [i for i, _ in result] == [i for i, _ in exact]
+        assert np.allclose([s for _, s in result], [s for _, s in exact])
+
+
+def test_quantized_weights_rank_like_float64():
+    vectorizer = train()
+    texts = [["catalog", "system"], ["flow"], ["index", "retriev", "evalu"]]
+    expected = vectorizer.query_many(texts, count=len(DOCS))
+    for quantization in ["float32", "float16", "int8"]:
+        quantized = Vectorizer(quantization=quantization)
+        quantized.train(DOCS)
+        assert quantized.segments[0].tf.data.dtype == np.dtype(quantization)
+        assert np.allclose(
+            quantized.weights.to_dense(), vectorizer.weights.to_dense(), atol=1e-2
+        )
+        results = quantized.query_many(texts, count=len(DOCS))
+        assert [result[0][0] for result in results] == [
+            result[0][0] for result in expected
+        ]
+        loaded = Vectorizer()
+        loaded.from_arrays(quantized.terms, quantized.to_arrays())
+        assert loaded.quantization == quantization
+        assert loaded.query_many(texts, count=len(DOCS)) == results
@@ -0,0 +1,77 @@
+import json
+
+from docsfinder.core.engine import Engine, served_versions
+from docsfinder.core.models import Document
+from docsfinder.core.store import build_store
+from docsfinder.core.vectorizer import Vectorizer
+from docsfinder.core.watcher import IndexWatcher
+
+
+def save(root: str, contents) -> str:
+    engine = Engine()
+    vectorizer = Vectorizer()
+    vectorizer.train([content.split() for content in contents])
+    documents = [
+        Document(id=str(i), title="Title", content=content)
+        for i, content in enumerate(contents)
+    ]
+    engine.swap(vectorizer, build_store(documents))
+    return engine.save(root)
+
+
+def test_watcher_swaps_in_new_versions(tmp_path):
+    root = str(tmp_path)
+    first = save(root, ["librari catalog", "wing flow"])
+    engine = Engine()
+    engine.load(root=root)
+    _, before, _ = engine.snapshot()
+    watcher = IndexWatcher(engine, root)
+    assert not watcher.check()
+    second = save(root, ["librari catalog", "wing flow", "index retriev"])
+    assert watcher.check()
+    assert engine.version == second != first
+    assert engine.status().documents == 3
+    # Queries that took the old snapshot keep a complete index
+    assert len(before.deleted) == 2
+    (tmp_path / "CURRENT").write_text("missing")
+    assert not watcher.check()
+    assert watcher.failed == "missing"
+    assert engine.version == second
+
+
+def test_watcher_skips_versions_that_fail_to_load(tmp_path):
+    root = str(tmp_path)
+    first = save(root, ["librari catalog", "wing flow"])
+    engine = Engine()
+    engine.load(root=root)
+    watcher = IndexWatcher(engine, root, interval=0.01).start()
+    second = save(root, ["librari catalog", "wing flow", "index retriev"])
+    # A complete version whose arrays don't match what the engine expects
+    manifest = tmp_path / second / "manifest.json"
+    content = json.loads(manifest.read_text())
+    del content["files"]["idf.npy"]
+    manifest.write_text(json.dumps(content))
+    watcher.stopped.wait(0.2)
+    assert watcher.thread.is_alive()
+    assert watcher.failed == second
+    assert engine.version == first
+    third = save(root, ["librari catalog"])
+    watcher.stopped.wait(0.2)
+    watcher.stop()
+    assert engine.version == third
+
+
+def test_snapshots_record_the_version_they_serve(tmp_path):
+    root = str(tmp_path)
+    first = save(root, ["librari catalog", "wing flow"])
+    engine = Engine()
+    engine.load(root=root)
+    versions = []
+    token = served_versions.set(versions)
+    engine.snapshot()
+    served_versions.reset(token)
+    second = save(root, ["librari catalog"])
+    engine.load(root=root)
+    engine.snapshot()
+    assert versions == [first]
+    assert engine.version == second